@@ -11,42 +11,46 @@ class UpdateSignal(QtCore.QObject):
 
 # Annotation widget for individual depths
 class AnnotateWidget(QtGui.QWidget):
-	def __init__(self, src, patient, depth, channel):
+	def __init__(self, src, patient=None, depth=None, channel=None):
 		super(AnnotateWidget, self).__init__()
 
 		self.init_ui()
 
-		self.patient = patient
 		self.src = src
-		self.id = (depth, channel)
+		self.patient = None
+		self.id = (None, None)
 
-		# Connect update signal
+		# Connect update signal, once for the lifetime of the widget
 		self.src.s.annotation_list_added.connect(self.add_tag)
 
 		# Populate list widget
-		self.list_items = list(settings.depth_labels)
+		self.list_items = []
+		self.items = {}
+		for item in settings.depth_labels:
+			self.add_tag(item)
+
+		# Connect item selection signal
+		self.list_widget.itemSelectionChanged.connect(self.selection_changed)
+
+		self.rebind(patient, depth, channel)
+
+	# Show the labels of another depth and channel, the list is reused
+	def rebind(self, patient, depth, channel):
+		self.patient = patient
+		self.id = (depth, channel)
 
 		# Check if the patient already has selected depth labels
-		preloaded = False
+		labels = []
 		if self.patient is not None:
-			if self.id in self.patient.depth_labels:
-				preloaded = True
-				for label in self.patient.depth_labels[self.id]:
-					if label not in self.list_items:
-						self.list_items.append(label)
-
-		# Add all items
-		for item in self.list_items:
-			list_item = QtGui.QListWidgetItem(item)
-			self.list_widget.addItem(list_item)
+			labels = self.patient.depth_labels.get(self.id, [])
+			for label in labels:
+				self.add_tag(label)
 
-			# Select the item if already loaded
-			if preloaded:
-				if item in self.patient.depth_labels[self.id]:
-					self.list_widget.setItemSelected(list_item, True)
-
-		# Connect item selection signal
-		self.list_widget.itemSelectionChanged.connect(self.selection_changed)
+		# Selection is restored, not an annotation
+		self.list_widget.blockSignals(True)
+		for text, list_item in self.items.iteritems():
+			list_item.setSelected(text in labels)
+		self.list_widget.blockSignals(False)
 
 	def init_ui(self):
 
@@ -69,13 +73,11 @@ class AnnotateWidget(QtGui.QWidget):
 		self.setLayout(layout)
 
 	def emit_tag(self):
-		text = self.new_tag_line.text()
+		text = str(self.new_tag_line.text())
 
-		if text not in self.list_items and text != '':
-			self.list_items.append(text)
-			list_item = QtGui.QListWidgetItem(text)
-			self.list_widget.addItem(list_item)
-			list_item.setSelected(True)
+		if text not in self.items and text != '':
+			self.add_tag(text)
+			self.items[text].setSelected(True)
 
 			# Notify all other annotation widgets
 			if 'depth_tags' not in settings.modified:
@@ -84,10 +86,12 @@ class AnnotateWidget(QtGui.QWidget):
 			self.src.s.annotation_list_added.emit(text)
 
 	def add_tag(self, text):
-		if text not in self.list_items and text != '':
+		text = str(text)
+		if text not in self.items and text != '':
 			self.list_items.append(text)
 			list_item = QtGui.QListWidgetItem(text)
 			self.list_widget.addItem(list_item)
+			self.items[text] = list_item
 
 	# def add_tag(self):
 	# 	text = self.new_tag_line.text()
@@ -99,7 +103,7 @@ class AnnotateWidget(QtGui.QWidget):
 
 	def selection_changed(self):
 		if self.patient is not None:
-			self.patient.depth_labels[self.id] = [str(item.text()) for item in self.list_widget.selectedItems()]
+			self.patient.set_depth_labels(self.id, [str(item.text()) for item in self.list_widget.selectedItems()])
 			self.src.s.repaint_dc.emit()
 
 
@@ -1,12 +1,17 @@
 import pyqtgraph as pg
 from pyqtgraph import QtCore
 from core.data import settings
-from core.data import preprocess_audio
+from core.data import audio
 pg.setConfigOption('useOpenGL', False)
 import numpy as np
-import sounddevice as sd
 
-AUDIO_TIMER_UPDATE = 10 # In ms
+AUDIO_TIMER_UPDATE = 10 # In ms, only redraws the line
+
+# Audio scaling is computed in the background after prefetching
+AUDIO_STATS_PRIORITY = 200
+
+# Displayed data is loaded before any prefetching
+LOAD_PRIORITY = 0
 
 class MultiLine(pg.QtGui.QGraphicsPathItem):
     def __init__(self, x, y):
@@ -28,6 +33,9 @@ class UpdateSignal(QtCore.QObject):
 
     title_updated = QtCore.pyqtSignal(str)
 
+    # Loaded data delivered from a worker thread
+    data_loaded = QtCore.pyqtSignal(object)
+
 
 class BothClickButton(pg.QtGui.QPushButton):
 
@@ -51,8 +59,11 @@ class DefaultPlotWidget(pg.PlotWidget):
         self.src = src
         self._title = ''
 
-        # Modes: subsample, mean, peak
-        self.getPlotItem().setDownsampling(ds=True, auto=True, mode='subsample')
+        # Traces are downsampled by their min/max pyramid, see update_curve
+        self.curve = None
+        self.pyramid = None
+        self.getViewBox().sigXRangeChanged.connect(self.update_curve)
+        self.getViewBox().sigResized.connect(self.update_curve)
 
         # Disable autorange for performance enhancements
         self.getViewBox().disableAutoRange()
@@ -62,6 +73,14 @@ class DefaultPlotWidget(pg.PlotWidget):
         # self.show()
 
         self.data = []
+        self.data_id = None
+
+        # Data is loaded on worker threads, results of older requests are dropped
+        self.request = 0
+        self.auto_range_pending = False
+
+        # Patient, channel and depth of the displayed or loading data
+        self.values = None
 
         # Default plot settings
         self.x_scale = float(settings.data_hz)
@@ -72,6 +91,7 @@ class DefaultPlotWidget(pg.PlotWidget):
 
         # Signal for updating title of dock
         self.s = UpdateSignal()
+        self.s.data_loaded.connect(self.data_loaded)
 
         # Guard flag
         self.guard = False
@@ -112,6 +132,10 @@ class DefaultPlotWidget(pg.PlotWidget):
         self.audio_line = None
         self.audio_timer = pg.QtCore.QTimer()
 
+        # Output pulls processed audio as it plays
+        self.sink = None
+        self.audio_stream = None
+
     # def wheelEvent(self, event):
     #     # Prevent scrolling in the larger scroll area
     #     event.ignore()
@@ -122,8 +146,17 @@ class DefaultPlotWidget(pg.PlotWidget):
 
     # Play audio
     def play_audio(self):
+        # Nothing to play while loading
+        if self.play_button.isChecked() and self.data_id is None:
+            self.play_button.setChecked(False)
+            return
+
         if self.play_button.isChecked():
-            data = preprocess_audio(self.data, spikes_only=self.play_spike_audio)
+            if self.sink is None:
+                self.sink = audio.make_sink()
+            self.audio_stream = audio.AudioStream(
+                self.data, self.x_scale, self.sink.samplerate,
+                spikes_only=self.play_spike_audio, stats=self.audio_stats())
 
             # Track progress
             if settings.show_audio_line:
@@ -131,8 +164,7 @@ class DefaultPlotWidget(pg.PlotWidget):
                 self.audio_timer = pg.QtCore.QTimer()
                 self.audio_timer.setInterval(AUDIO_TIMER_UPDATE)
                 self.audio_timer.timeout.connect(self.update_audio_line)
-            sd.stop()
-            sd.play(data)
+            self.sink.start(self.audio_stream)
             if settings.show_audio_line:
                 self.audio_timer.start()
 
@@ -141,16 +173,29 @@ class DefaultPlotWidget(pg.PlotWidget):
             self.src.s.stop_audio.emit()
             
         else:
-            sd.stop()
+            self.sink.stop()
             self.audio_timer.stop()
             if settings.show_audio_line:
                 self.audio_line.hide()
                 self.audio_line = None
 
+    # Scaling statistics of the displayed data, kept with the data in the cache
+    def audio_stats(self):
+        return self.warm_audio_stats(('audio',) + self.data_id, self.data)
+
+    # Also runs on worker threads, so that playback starts at once
+    def warm_audio_stats(self, stats_id, data):
+        stats = self.src.cache.get(stats_id)
+        if stats is None:
+            stats = audio.audio_stats(data)
+            self.src.load(stats_id, stats)
+        return stats
+
     # Stop audio on signal
     def external_pause(self):
         if not self.guard:
             if self.play_button.isChecked():
+                self.sink.stop()
                 self.audio_timer.stop()
 
                 if settings.show_audio_line:
@@ -176,14 +221,13 @@ class DefaultPlotWidget(pg.PlotWidget):
             self.play_spike_audio = True
         self.play_button.setChecked(False)
 
-    # Update the line
+    # Update the line to the frame currently being heard
     def update_audio_line(self):
-        value = self.audio_line.value() + AUDIO_TIMER_UPDATE/float(1000)
-        if value > (len(self.data) / self.x_scale):
+        if not self.sink.active():
             self.play_button.setChecked(False)
             self.play_audio()
         else:
-            self.audio_line.setValue(value)
+            self.audio_line.setValue(self.audio_stream.seconds(self.sink.position()))
 
     '''
     Data Methods
@@ -193,6 +237,7 @@ class DefaultPlotWidget(pg.PlotWidget):
         self.clear()
         self.showButtons()
         self.data = data
+        self.curve = None
         try:
             points = data.shape[0]
             lines = data.shape[1]
@@ -208,14 +253,17 @@ class DefaultPlotWidget(pg.PlotWidget):
                 xdata = np.tile(np.arange(points), (lines, 1))
 
                 # Assume data is vertical
-                item = MultiLine(xdata, data.T)
+                item = MultiLine(xdata, np.asarray(data).T)
                 item.setPen(pg.mkPen('w'))
                 self.addItem(item)
 
                 # self.getViewBox().enableAutoRange()
                 self.autoRange()
         except IndexError:
-            self.plot(np.arange(len(data)) / self.x_scale, data / self.y_scale, pen=pg.mkPen(width=1))
+            # Only the samples or blocks of the visible range are drawn
+            self.pyramid = self.src.get_pyramid(self.data_id, data)
+            self.curve = self.plot(pen=pg.mkPen(width=1))
+            self.update_curve(full=True)
 
             # Update title
             text = 'Recording length: %f (s)' % (len(data) / self.x_scale)
@@ -223,6 +271,31 @@ class DefaultPlotWidget(pg.PlotWidget):
 
             # self.getViewBox().enableAutoRange()
 
+    # Draw the pyramid level and window matching the view range
+    def update_curve(self, *args, **kwargs):
+        if self.curve is None:
+            return
+
+        view = self.getViewBox()
+        if kwargs.get('full'):
+            start, stop = 0, len(self.data)
+        else:
+            x_range = view.viewRange()[0]
+            start, stop = x_range[0] * self.x_scale, x_range[1] * self.x_scale
+
+        x, y = self.pyramid.window(self.data, start, stop, max(view.width(), 1))
+        self.curve.setData(x / self.x_scale, y / self.y_scale)
+
+    # Full extent of the trace for auto ranging, the view range then narrows it again
+    def autoRange(self, *args, **kwargs):
+        # Applied once the data has arrived
+        if self.data_id is None:
+            self.auto_range_pending = True
+            return
+
+        self.update_curve(full=True)
+        self.getPlotItem().autoRange(*args, **kwargs)
+
     def set_text(self, text):
         text_item = pg.TextItem(text)
         self.addItem(text_item, ignoreBounds=True)
@@ -233,12 +306,63 @@ class DefaultPlotWidget(pg.PlotWidget):
         self.getViewBox().disableAutoRange()
         self.hideButtons()
 
+    # Placeholder at the center of the current view, leaves the view range alone
+    def show_placeholder(self, text='Loading...'):
+        self.clear()
+        self.curve = None
+        self.hideButtons()
+
+        text_item = pg.TextItem(text, anchor=(0.5, 0.5))
+        self.addItem(text_item, ignoreBounds=True)
+        x_range, y_range = self.getViewBox().viewRange()
+        text_item.setPos(sum(x_range) / 2., sum(y_range) / 2.)
+
     def update_plot(self):
-        # Load complete depth file
-        self.data_id = self.patient.load(self.depth)
-        data = self.src.cache[self.data_id][self.channel].squeeze()
+        # Also drops loads of the previous values
+        self.release_data()
+        self.show_placeholder()
+
+        self.src.workers.submit(('load', self), LOAD_PRIORITY,
+            self.load_data, self.request, self.patient, self.depth, self.channel)
+
+    # Runs on a worker thread, the result is plotted by data_loaded
+    def load_data(self, request, patient, depth, channel):
+        if request != self.request:
+            return
+
+        # Failed loads replace the placeholder as well, the error is printed by the pool
+        result = (request, None, None)
+        try:
+            # Load displayed channel of the depth file, kept here as it may be evicted meanwhile
+            data_id, data = patient.load(depth, channel)
+            if data_id is not None:
+                # Lazy (v7.3) and segmented channels stay lazy, only displayed windows are read
+                data = data.squeeze()
+
+                # Display pyramid is built here as well, reading the channel in chunks
+                if data.size > 1 and data.ndim == 1:
+                    self.src.get_pyramid(data_id, data)
+            result = (request, data_id, data)
+        finally:
+            self.s.data_loaded.emit(result)
+
+    def data_loaded(self, result):
+        request, data_id, data = result
+        if request != self.request:
+            return
+
+        if data_id is None:
+            self.show_placeholder('No data')
+            return
+
+        # Keep displayed data from being evicted, it may already be
+        self.src.cache.pin(data_id)
+        if data_id not in self.src.cache:
+            self.src.load(data_id, data)
+        self.data_id = data_id
 
         self.clear()
+        self.curve = None
 
         '''
         Handling of data types to be done modularly?
@@ -246,12 +370,45 @@ class DefaultPlotWidget(pg.PlotWidget):
         # Text display for single value (usually constant)
         if data.size == 1:
             self.text_mode()
-            text = str(self.channel) + ' = ' + str(data)
+            text = str(self.channel) + ' = ' + str(np.asarray(data))
             self.set_text(text)
         else:
             self.plot_data(data)
+            self.src.workers.submit(('audio', self), AUDIO_STATS_PRIORITY,
+                self.warm_audio_stats, ('audio',) + self.data_id, data)
+
+            if self.auto_range_pending:
+                self.autoRange()
+        self.auto_range_pending = False
+
+    # Allow displayed data to be evicted from the cache again
+    def release_data(self):
+        # Loads still running are ignored on arrival
+        self.request += 1
+        self.src.workers.cancel(('load', self))
+        self.values = None
+
+        if self.data_id is not None:
+            self.src.cache.unpin(self.data_id)
+            self.data_id = None
+
+    # Drop data and playback before the widget is reused
+    def recycle(self):
+        if self.play_button.isChecked():
+            self.play_button.setChecked(False)
+            self.play_audio()
+
+        self.release_data()
+        self.clear()
+        self.curve = None
+        self.pyramid = None
+        self.data = []
 
     def update_values(self, patient, channel, depth):
+        # Unchanged docks keep their plot
+        if (patient, channel, depth) == self.values:
+            return
+
         self.patient = patient
         self.channel = channel
         self.depth = depth
@@ -260,8 +417,9 @@ class DefaultPlotWidget(pg.PlotWidget):
         self._title = 'Depth: %.2f' % depth
         self.setTitle(self._title)
 
+        # Plotted once loaded in the background
         self.update_plot()
-        return self.data_id  # Maybe useful eventually
+        self.values = (patient, channel, depth)
 
     def get_title(self):
         return self._title
@@ -1,7 +1,8 @@
 import math
 import numpy as np
-from bisect import bisect_left
+from bisect import bisect_left, bisect_right
 from PyQt4 import QtGui, QtCore
+import pyqtgraph as pg
 from scipy.signal import savgol_filter, butter, filtfilt
 from core.data import settings
 
@@ -9,8 +10,10 @@ from core.data import settings
 # Constant settings
 VERTICAL_PADDING_FRACTION = 1. / 20
 HASH_LINE_COLOR = (50, 50, 50, 128)
-HASH_BACKGROUND_COLOR = (150, 150, 150, 128)
+HASH_BACKGROUND_FILL = (150, 150, 150, 192)
 DOTS_COLOR = (0, 0, 0)
+TRANSLATION_SETTLE_MS = 150
+LAYER_OVERSCAN = .5  # Fraction of the axis height drawn above and below while translating
 
 
 # Signal class
@@ -75,6 +78,23 @@ class DepthControl(QtGui.QWidget):
         # Annotation mode
         self.annotation_mode = False
 
+        # Cached static layers, see paintEvent
+        self.layer = None
+        self.layer_key = None
+        self.layer_mid = None
+        self.layer_span = None
+        self.layer_shift = 0
+        self.overscan = 0
+        self.visible_heights = {}
+
+        # Translated layers are redrawn once dragging pauses
+        self.settle_timer = QtCore.QTimer()
+        self.settle_timer.setSingleShot(True)
+        self.settle_timer.timeout.connect(self.refresh)
+
+        # Tooltip hit-testing, rebuilt with the layer
+        self.d_tooltips = DepthTooltip()
+
     def set_defaults(self, start=settings.depth_control_axis[0], end=settings.depth_control_axis[1], unit_value=1, notch_disp=5):
         self.start = start  # Value associated with top pixel of axis
         self.end = end
@@ -118,19 +138,102 @@ class DepthControl(QtGui.QWidget):
 
     def updateDepths(self, new):
         self.depths = new
+        self.invalidate()
 
     def updatePatient(self, patient):
         self.patient = patient
+        self.invalidate()
 
     def updateChannel(self, channel):
         self.channel = channel
+        self.invalidate()
+
+    # Static layers are redrawn on the next paint (hashrates or annotations changed)
+    def invalidate(self):
+        self.layer = None
+
+    def refresh(self):
+        self.invalidate()
+        self.repaint()
+
+    # Hashrates are computed in the background and may not be available yet
+    def hashes_available(self):
+        if not self.display_hashes or self.patient is None or self.channel is None:
+            return False
+        return self.patient.hashrates is not None and self.channel in self.patient.hashrates
 
     def paintEvent(self, e):
 
+        # Translations shift the cached layer by up to its overscan, anything else redraws it
+        # Layers drawn while translating extend past the axis, so the following steps fit
+        # Around the axis, room is left for the notch labels
+        margin = self.fontMetrics().height()
+        shift = self.layer_offset()
+        if shift is None or (shift and abs(shift) + margin > self.overscan):
+            if self.settle_timer.isActive():
+                self.overscan = int(self.get_axis_height() * LAYER_OVERSCAN)
+            else:
+                self.overscan = 0
+            self.layer = self.render_layer()
+            self.layer_key = (self.width(), self.height(), self.unit_value, self.notch_disp)
+            self.layer_mid = self.mid
+            self.layer_span = self.start - self.end
+            shift = 0
+        self.layer_shift = shift
+
         qp = QtGui.QPainter()
         qp.begin(self)
+
+        # The overscan is only shown once translated into the axis
+        if self.overscan:
+            v_padding = self.height() * self.vpf
+            qp.setClipRect(QtCore.QRectF(0, v_padding - margin, self.width(), self.height() - 2 * (v_padding - margin)))
+        qp.drawPixmap(0, shift - self.overscan, self.layer)
+
+        # Selection is drawn live on top
+        self.draw_selected(qp)
+        qp.end()
+
+    # Pixel offset of the current view from the cached layer, None if only redrawing fits
+    def layer_offset(self):
+        key = (self.width(), self.height(), self.unit_value, self.notch_disp)
+        if self.layer is None or key != self.layer_key:
+            return None
+
+        # Start and end are moved together, compare the span with a tolerance
+        if not np.isclose(self.start - self.end, self.layer_span):
+            return None
+        return int(round((self.mid - self.layer_mid) * self.get_unit_height()))
+
+    # Render axis, hashes, depths and annotations into a pixmap, extended by the overscan
+    def render_layer(self):
+        layer = QtGui.QPixmap(self.width(), self.height() + 2 * self.overscan)
+        layer.fill(QtCore.Qt.transparent)
+
+        qp = QtGui.QPainter()
+        qp.begin(layer)
+        qp.initFrom(self)
+        qp.translate(0, self.overscan)
         self.drawWidget(qp)
         qp.end()
+        return layer
+
+    # Padding and height of the band drawn into the layer, the axis and its overscan
+    def layer_band(self):
+        v_padding = self.height() * self.vpf
+        axis_height = self.height() - 2 * v_padding
+        return v_padding - self.overscan, axis_height + 2 * self.overscan
+
+    def draw_selected(self, qp):
+        qpen = QtGui.QPen()
+        qpen.setWidth(3)
+        qpen.setBrush(QtCore.Qt.red)
+        qp.setPen(qpen)
+
+        depth_width = self.size().width() / 2
+        for depth in self.selected:
+            if depth in self.visible_heights:
+                qp.drawPoint(depth_width, self.visible_heights[depth] + self.layer_shift)
 
     def drawWidget(self, qp):
 
@@ -145,8 +248,7 @@ class DepthControl(QtGui.QWidget):
         height = size.height()
 
         # Vertical padding (top and bottom) for axis
-        v_padding = height * self.vpf
-        axis_height = height - (2 * v_padding)
+        v_padding, axis_height = self.layer_band()
 
         # Draw dots
         qpen = QtGui.QPen()
@@ -156,52 +258,45 @@ class DepthControl(QtGui.QWidget):
         # unit_height = float(axis_height) / (self.start - self.end)
         unit_height = self.get_unit_height()
 
-        self.depth_heights = []
-        depth_widths = []
-        adjusted_depths = []
-        for depth in self.depths:
-            depth_height = (height / 2.) - (depth - self.mid) * unit_height
-            depth_width = width / 2
-            if (depth_height >= v_padding - qpen.width() and
-                    depth_height <= v_padding + axis_height):
-
-                # Draw hash display if needed:
-                if self.display_hashes:
-                    if self.patient is not None and self.channel is not None:
-                        hashpen = QtGui.QPen()
-                        hashpen.setWidth(2)
-                        color = QtGui.QColor(*HASH_LINE_COLOR)
-                        hashpen.setColor(color)
-                        qp.setPen(hashpen)
-
-                        # Calculate relative width
-                        w_ratio = self.patient.hash_depth_list[self.channel][depth]
-                        x1 = max(int((1-w_ratio)*float(width)/2), 0)
-                        x2 = width - x1
-                        qp.drawLine(x1, depth_height, x2, depth_height)
-
-                # Draw the point itself
-                if depth in self.selected:
-                    qpen.setBrush(QtCore.Qt.red)
-                    qp.setPen(qpen)
-                else:
-                    qpen.setBrush(QtCore.Qt.blue)
-                    qp.setPen(qpen)
-
-                qp.drawPoint(depth_width, depth_height)
-
-            self.depth_heights.append(depth_height)
-            depth_widths.append(depth_width)
-            adjusted_depths.append(depth)
+        # Positions of all depths at once
+        depths = np.array(self.depths, dtype=float)
+        heights = (height / 2.) - (depths - self.mid) * unit_height
+        visible = (heights >= v_padding - qpen.width()) & (heights <= v_padding + axis_height)
+
+        self.depth_heights = heights.tolist()
+        self.visible_heights = dict(zip(depths[visible].tolist(), heights[visible].tolist()))
+        depth_width = width / 2
+
+        # Draw hash display if needed, one call for all lines
+        hashes = self.hashes_available()
+        if hashes and visible.any():
+            hashpen = QtGui.QPen()
+            hashpen.setWidth(2)
+            hashpen.setColor(QtGui.QColor(*HASH_LINE_COLOR))
+            qp.setPen(hashpen)
+
+            # Calculate relative widths, depths added by the watcher may not have hashrates yet
+            w_list = self.patient.hash_depth_list[self.channel]
+            hashed = np.array([depth in w_list for depth in depths.tolist()], dtype=bool) & visible
+            w_ratio = np.array([w_list[depth] for depth in depths[hashed].tolist()], dtype=float)
+            x1 = np.maximum(((1 - w_ratio) * float(width) / 2).astype(int), 0)
+            x2 = width - x1
+            y = heights[hashed].astype(int)
+            qp.drawLines([QtCore.QLineF(*line) for line in zip(x1.tolist(), y.tolist(), x2.tolist(), y.tolist())])
+
+        # Draw the points themselves, selected points are drawn over them
+        qpen.setBrush(QtCore.Qt.blue)
+        qp.setPen(qpen)
+        qp.drawPoints(QtGui.QPolygonF([QtCore.QPointF(depth_width, y) for y in heights[visible].astype(int).tolist()]))
 
         # Setup appropriate tooltips
-        if self.display_hashes and self.patient is not None and self.channel is not None:
+        if hashes:
             hashrates = self.patient.hashrates[self.channel]
         else:
             hashrates = None
 
-        self.d_tooltips = DepthTooltip(
-            adjusted_depths, depth_widths, self.depth_heights, 
+        self.d_tooltips.rebuild(
+            self.depths, depth_width, self.depth_heights,
             pen_width, hashrates)
 
         # Draw the bar display on the side
@@ -215,8 +310,7 @@ class DepthControl(QtGui.QWidget):
         height = size.height()
 
         # Vertical padding (top and bottom) for axis
-        v_padding = height * self.vpf
-        axis_height = height - 2 * v_padding
+        v_padding, axis_height = self.layer_band()
 
         # Axis line
         qp.drawLine(width / 2, v_padding, width / 2, v_padding + axis_height)
@@ -236,7 +330,8 @@ class DepthControl(QtGui.QWidget):
         pen_width = qpen.width()
         qp.setPen(qpen)
 
-        for notch in self.notches:
+        extra = self.overscan / unit_height
+        for notch in self.notch_values(self.start + extra, self.end - extra):
             nh = (height / 2.) - (notch - self.mid) * unit_height
 
             if nh > v_padding + axis_height:
@@ -286,36 +381,42 @@ class DepthControl(QtGui.QWidget):
         self.end += dy
 
         self.updateNotches()
+        self.settle_timer.start(TRANSLATION_SETTLE_MS)
         self.repaint()
 
     def updateNotches(self):
+        self.notches = self.notch_values(self.start, self.end)
+
+    def notch_values(self, start, end):
         start = math.floor(
-            self.start / self.unit_value) * float(self.unit_value)
+            start / self.unit_value) * float(self.unit_value)
         end = math.ceil(
-            self.end / self.unit_value) * float(self.unit_value) - self.unit_value
-        self.notches = np.arange(start, end, -self.unit_value)
+            end / self.unit_value) * float(self.unit_value) - self.unit_value
+        return np.arange(start, end, -self.unit_value)
 
     # Draw the smoothed hashfunction
     def draw_smoothed_hash(self, qp):
-        if self.display_hashes and self.patient is not None and self.channel is not None:
+        if self.hashes_available():
 
             # Constants
             size = self.size()
             width = size.width()
             height = size.height()
-            v_padding = height * self.vpf
-            axis_height = height - (2 * v_padding)
+            v_padding, axis_height = self.layer_band()
             unit_height = self.get_unit_height()
 
             # Vector to smooth
-            smoothed = np.zeros(int(self.get_axis_height())+1)
+            smoothed = np.zeros(int(axis_height)+1)
 
             # Offset factor used in main drawWidget method
             pen_width = 3
 
-            # Loop through all relevant depths
+            # Loop through all relevant depths, skipping those without hashrates yet
+            hash_list = self.patient.hash_depth_list[self.channel]
             current = []
             for depth in self.depths:
+                if depth not in hash_list:
+                    continue
                 depth_height = (height / 2.) - (depth - self.mid) * unit_height
                 depth_width = width / 2
                 if (depth_height >= v_padding - pen_width and
@@ -324,7 +425,7 @@ class DepthControl(QtGui.QWidget):
                 #         depth_height <= v_padding + axis_height):
 
                     # Normalized hash value
-                    normalized = self.patient.hash_depth_list[self.channel][depth]
+                    normalized = hash_list[depth]
                     smoothed[int(depth_height - v_padding)] = normalized
                     current.append(normalized)
 
@@ -356,21 +457,33 @@ class DepthControl(QtGui.QWidget):
                 smoothed[first_height] = 0
                 smoothed[last_height:] = 0
 
-                import pyqtgraph as pg
-                # pg.plot(smoothed)
-                # Now draw the smoothed background
-                for idx, w_ratio in enumerate(smoothed):
-                    if w_ratio > 0:
-                        hashpen = QtGui.QPen()
-                        hashpen.setWidth(2)
-                        color = QtGui.QColor(*HASH_BACKGROUND_COLOR)
-                        hashpen.setColor(color)
-                        qp.setPen(hashpen)
-
-                        # Calculate relative width
-                        x1 = max(int((1-w_ratio)*float(width)/2), 0)
-                        x2 = width - x1
-                        qp.drawLine(x1, v_padding + idx, x2, v_padding + idx)
+                # Now draw the smoothed background as one filled path
+                # Rows were drawn as overlapping 2px lines, so the fill is blended twice as strong
+                path = self.smoothed_hash_path(smoothed, width, v_padding)
+                qp.fillPath(path, QtGui.QColor(*HASH_BACKGROUND_FILL))
+
+    # Outline of each run of nonzero rows of the smoothed hash
+    def smoothed_hash_path(self, smoothed, width, v_padding):
+        path = QtGui.QPainterPath()
+        rows = np.flatnonzero(smoothed > 0)
+        if rows.size == 0:
+            return path
+
+        # Calculate relative widths, 1px added for the former line caps
+        x1 = np.maximum(((1 - smoothed[rows]) * float(width) / 2).astype(int), 0) - 1
+        x2 = width - x1
+        y = v_padding + rows
+
+        # Split into runs of consecutive rows
+        breaks = np.flatnonzero(np.diff(rows) != 1) + 1
+        for run in np.split(np.arange(rows.size), breaks):
+            top = y[run[0]] - 1
+            bottom = y[run[-1]] + 1
+            xs = np.concatenate([[x1[run[0]]], x1[run], [x1[run[-1]], x2[run[-1]]], x2[run][::-1], [x2[run[0]]]])
+            ys = np.concatenate([[top], y[run], [bottom, bottom], y[run][::-1], [top]])
+            path.addPath(pg.arrayToQPath(xs.astype(float), ys.astype(float)))
+            path.closeSubpath()
+        return path
 
     # Draw annotation progress bar
     def draw_annotation_bar(self, qp):
@@ -380,14 +493,15 @@ class DepthControl(QtGui.QWidget):
             size = self.size()
             width = size.width()
             height = size.height()
-            v_padding = height * self.vpf
-            axis_height = height - (2 * v_padding)
+            v_padding, axis_height = self.layer_band()
             unit_height = self.get_unit_height()
 
             # Depth mapping dictionary
             depths_dict = dict(zip(self.depths, self.depth_heights))
 
-            bar, dots = self.patient.get_annotation_markers(self.channel)
+            # Only markers touching the displayed depths
+            extra = self.overscan / unit_height
+            bar, dots = self.patient.get_annotation_markers(self.channel, (self.start + extra, self.end - extra))
 
             # Draw all bars
             pen = QtGui.QPen()
@@ -455,8 +569,8 @@ class DepthControl(QtGui.QWidget):
             self.s.translation_updated.emit(float(dy))
             self.translation(float(dy))
 
-        # Check for tooltips
-        text = self.d_tooltips.tooltip(event.pos())
+        # Check for tooltips, hit-testing follows the cached layer
+        text = self.d_tooltips.tooltip(event.pos() - QtCore.QPoint(0, self.layer_shift))
         if text:
             QtGui.QToolTip.showText(self.mapToGlobal(event.pos()), text, self)
         else:
@@ -475,7 +589,7 @@ class DepthControl(QtGui.QWidget):
             for depth in depths:
 
                 # Assuming depth x = middle line, depth y in list
-                point = (self.size().width() / 2, depth[1])
+                point = (self.size().width() / 2, depth[1] + self.layer_shift)
                 if rect.contains(*point):
                     # self.selected.append(depth[0])
                     newly_selected.append(depth[0])
@@ -499,6 +613,11 @@ class DepthControl(QtGui.QWidget):
         elif event.button() == QtCore.Qt.RightButton:
             self.drag = False
 
+            # Redraw at the final position without the overscan
+            if self.settle_timer.isActive():
+                self.settle_timer.stop()
+                self.refresh()
+
     def wheelEvent(self, event):
         # Notify other links
         self.active_select = True
@@ -537,28 +656,37 @@ class DepthControl(QtGui.QWidget):
 
 
 class DepthTooltip(QtGui.QWidget):
-    def __init__(self, depths, depth_widths, depth_heights, pen_width, hashrates):
+    '''
+    Hit-testing of depth points and annotation markers by pixel position
+    Rebuilt with the cached layer, lookups bisect sorted heights
+    '''
+    def __init__(self):
+        self.rebuild([], 0, [], 0, None)
+
+    def rebuild(self, depths, depth_width, depth_heights, pen_width, hashrates):
 
-        self.depths = np.array(depths)
-        self.depth_widths = np.array(depth_widths)
-        self.depth_heights = np.array(depth_heights)
+        # Depth points sorted by height
+        order = np.argsort(depth_heights, kind='mergesort')
+        self.depths = np.asarray(depths)[order].tolist()
+        self.depth_heights = np.asarray(depth_heights, dtype=float)[order].tolist()
+        self.depth_width = depth_width
         self.pen_width = pen_width / 2.
-        self.length = self.depths.size
         self.hashrates = hashrates
 
-        # Empty storage for custom displays
-        self.bars = []
-        self.dots = []
+        # Markers, sorted on the first lookup after loading
+        self.bars = {}
+        self.dots = {}
+        self.sorted = True
 
         # Create depth dictionary
-        self.depth_dict = dict(zip(self.depths, self.depth_heights))
+        self.depth_dict = dict(zip(depths, depth_heights))
 
         # Adjust for minor display discrepancies
         self.offsets()
 
     def offsets(self):
         # Point drawing shifts it over by 1 pixel
-        self.depth_widths = self.depth_widths + 1
+        self.depth_width = self.depth_width + 1
 
         # Makes it easier to acquire a point
         self.pen_width = self.pen_width + .7
@@ -575,59 +703,65 @@ class DepthTooltip(QtGui.QWidget):
         # Format of bar is ((d1, d2), text)
         depths, text = bar
         if depths[0] == depths[1]:
-            self.load_dot((depths[0], text))
+            self.load_dot((depths[0], [text]))
         else:
-            new = ((self.depth_dict[depths[0]], self.depth_dict[depths[1]]), text)
-            if new not in self.bars:
-                self.bars.append(new)
+            heights = sorted((self.depth_dict[depths[0]], self.depth_dict[depths[1]]))
+            self.bars[tuple(heights)] = text
+            self.sorted = False
 
     # Initialize tooltip for dots
     def load_dot(self, dot):
-        # Format of dot is (depth, text)
+        # Format of dot is (depth, labels)
         depth, text = dot
-        text = ', '.join(text)
-        new = (self.depth_dict[depth], text)
-        if new not in self.dots:
-            self.dots.append(new)
+        self.dots.setdefault(self.depth_dict[depth], ', '.join(text))
+        self.sorted = False
+
+    def sort_markers(self):
+        # Bars do not overlap, so both their tops and bottoms are in order
+        bars = sorted(self.bars.items())
+        self.bar_tops = [bar[0][0] for bar in bars]
+        self.bar_bottoms = [bar[0][1] for bar in bars]
+        self.bar_labels = [bar[1] for bar in bars]
+
+        dots = sorted(self.dots.items())
+        self.dot_heights = [dot[0] for dot in dots]
+        self.dot_labels = [dot[1] for dot in dots]
+        self.sorted = True
 
     '''
     Tooltip
     '''
     def tooltip(self, pos):
-        x_vec = np.abs(np.ones(self.length) * pos.x() - self.depth_widths)
-        y_vec = np.abs(np.ones(self.length) * pos.y() - self.depth_heights)
-        close_y = y_vec <= self.pen_width
+        if not self.sorted:
+            self.sort_markers()
+        x, y = pos.x(), pos.y()
 
         text = ''
-        # Check x is close
-        if x_vec[close_y].size != 0:
-            x_ind_min = np.argmin(x_vec[close_y])
-            ind_min = np.where(close_y)[0][x_ind_min]
-            # Check y is close
-            if x_vec[ind_min] <= self.pen_width:
-                depth = self.depths[ind_min]
-                if self.hashrates is None:
+        # Check the nearest depth point within the pen
+        if abs(x - self.depth_width) <= self.pen_width:
+            ind = bisect_left(self.depth_heights, y - self.pen_width)
+            if ind < len(self.depth_heights) and self.depth_heights[ind] <= y + self.pen_width:
+                depth = self.depths[ind]
+                if self.hashrates is None or depth not in self.hashrates:
                     text = str(depth)
                 else:
                     text = str(depth) + ', HR: ' + str(self.hashrates[depth]) + 'Hz'
 
         # In order of priority, we overlay the bar on the right
-        width = self.depth_widths[0] * 2
-        if np.abs(pos.x() - width) <= self.fat_width:
-            # Now we check for bars first
-            for bar in self.bars:
-                depths, label = bar
-                if depths[0]-self.fat_width <= pos.y() and pos.y() <= depths[1]+self.fat_width:
+        width = self.depth_width * 2
+        if abs(x - width) <= self.fat_width:
+            # Now we check for bars first, the lowest bar in reach wins
+            ind = bisect_right(self.bar_tops, y + self.fat_width) - 1
+            if ind >= 0 and self.bar_bottoms[ind] + self.fat_width >= y:
+                text = self.bar_labels[ind]
+
+            # Check for dots, the highest dot in reach wins
+            ind = bisect_left(self.dot_heights, y - self.fat_width)
+            if ind < len(self.dot_heights) and self.dot_heights[ind] <= y + self.fat_width:
+                label = self.dot_labels[ind]
+                if text != '':
+                    text = text + ' and ' + label
+                else:
                     text = label
 
-            # Check for dots
-            for dot in self.dots:
-                depth, label = dot
-                if depth-self.fat_width <= pos.y() and pos.y() <= depth+self.fat_width:
-                    if text != '':
-                        text = text + ' and ' + label
-                    else:
-                        text = label
-                    break
-
         return text
@@ -6,7 +6,6 @@ pg.setConfigOption('useOpenGL', False)
 import GUI
 
 from time import time
-import tqdm
 
 # import cProfile, pstats, StringIO
 
@@ -124,6 +123,16 @@ class Dock(Dock):
         title = 'Depth: %f' % self.depth
         super(Dock, self).__init__(title, **kwargs)
 
+    # Rebind a closed dock to another depth
+    def reuse(self, depth):
+        self.depth = depth
+        self._name = 'Depth: %f' % self.depth
+        self.setTitle(self._name)
+
+        # Closing detaches the title label as well
+        self.topLayout.addWidget(self.label, 0, 1)
+        self.label.show()
+
 
 # Signal class
 class UpdateSignal(QtCore.QObject):
@@ -148,12 +157,17 @@ class GraphArea(pg.QtGui.QWidget):
             self.dc = GUI.DepthControl()
         
         self.dc.s.selected_updated.connect(self.depths_updated)
-        self.src.s.repaint_dc.connect(self.dc.repaint)
+        self.src.s.repaint_dc.connect(self.dc.refresh)
+        self.src.s.hashrates_updated.connect(self.hashrates_updated)
+        self.src.s.depths_added.connect(self.depths_added)
         self.dc.display_hashes = settings.preprocess_hashes
 
         # Dict of depths with their plot widgets
         self.selected_depths = {}
 
+        # Closed docks kept with their widgets and connections for reuse
+        self.free_docks = []
+
         # Current link group
         self.cur_link = None
 
@@ -166,9 +180,6 @@ class GraphArea(pg.QtGui.QWidget):
         # Signals for interacting with all children
         self.s = UpdateSignal()
 
-        # Progress bar
-        self.pbar = None
-
         self.init_UI()
 
 
@@ -380,6 +391,17 @@ class GraphArea(pg.QtGui.QWidget):
         self.dc.updateSelected(None)
         self.dc.repaint()
 
+    # Repaint depth control once background hashrates arrive
+    def hashrates_updated(self, patient):
+        if str(patient) == self.cur_patient:
+            self.dc.refresh()
+
+    # Show recordings added during the session, keeping the selection
+    def depths_added(self, patient):
+        if str(patient) == self.cur_patient:
+            self.dc.updateDepths(self.src.patients[self.cur_patient].depths)
+            self.dc.repaint()
+
     def patient_update(self):
         # Update current patient and channel list
         self.cur_patient = self.pcombo.value()
@@ -403,9 +425,7 @@ class GraphArea(pg.QtGui.QWidget):
         # Remove all selected depths
         # self.selected_depths.clear()
         for depth in self.selected_depths.keys():
-            # Clear docks
-            self.selected_depths[depth].close()
-            self.selected_depths.pop(depth)
+            self.remove_plot_dock(depth)
 
         self.update_layout()
         self.update_plots()
@@ -428,17 +448,15 @@ class GraphArea(pg.QtGui.QWidget):
                 auto_range = True
             self.dc.repaint()
 
-        # Progress bar update
-        if self.pbar is not None:
-            self.pbar.set_description('Plotting data')
-
-        # Update all the split dock widgets
-        for depth, dock in self.selected_depths.iteritems():
+        # Update all the split dock widgets, data is loaded top dock first
+        for depth in sorted(self.selected_depths.iterkeys(), reverse=True):
+            dock = self.selected_depths[depth]
             dock.widgets[0].update(self.src, patient, channel, depth)
             if auto_range:
                 dock.widgets[0].auto_range_contents()
-            if self.pbar is not None:
-                self.pbar.update(1)
+
+        # Warm the cache around the selection
+        self.src.prefetcher.update(self, patient, self.dc.selected, channel)
 
     # @timeit
     def depths_updated(self):
@@ -452,41 +470,12 @@ class GraphArea(pg.QtGui.QWidget):
         # Add plot items necessary for new depths
         add = updated - previous
 
-        # Instantiate progress bar
-        total_length = len(purge) + len(add) + (2 * len(updated))
-
-        if total_length > 0:
-            print('\nVisualizing for channel: %s' % self.ccombo.value())
-            self.pbar = tqdm.tqdm(total=total_length)
-
         ### Delete previous docks ###
 
         # cur = time()
 
         for depth in purge:
-            # Progress bar description
-            if self.pbar is not None:
-                self.pbar.set_description('Deleting docks')
-
-            # Clear widget
-            # Seems bugged - does this actually close the widget?
-            self.selected_depths[depth].widgets[0].close()
-
-            ### Disconnect signals ###
-            self.s.x_range_updated.disconnect(self.selected_depths[depth].widgets[0].main_widget.set_x_range)
-            self.s.y_range_updated.disconnect(self.selected_depths[depth].widgets[0].main_widget.set_y_range)
-
-            if settings.annotation_on:
-                self.toggle_annotation.toggled.disconnect(self.selected_depths[depth].widgets[0].toggle_second_widget)
-
-            # Clear docks
-            self.selected_depths[depth].close()
-
-            self.selected_depths.pop(depth)
-
-            if self.pbar is not None:
-                self.pbar.update(1)
-
+            self.remove_plot_dock(depth)
 
         ### Add new docks ###
 
@@ -494,16 +483,7 @@ class GraphArea(pg.QtGui.QWidget):
         # cur = time()
 
         for depth in add:
-            # Progress bar update
-            if self.pbar is not None:
-                self.pbar.set_description('Loading data')
-
-            # Wrap the widget in a dock
-            widget =  GUI.DefaultPlotWidget(self.src)
-            self.add_plot_dock(depth, widget)
-
-            if self.pbar is not None:
-                self.pbar.update(1)
+            self.add_plot_dock(depth)
 
         # print('Time to add: %f' % (time() - cur))
         # cur = time()
@@ -516,6 +496,7 @@ class GraphArea(pg.QtGui.QWidget):
 
         ### Update plots ###
 
+        # Docks show a placeholder until their data arrives from the workers
         self.update_plots()
         # print('Time to update plots: %f' % (time() - cur))
 
@@ -531,27 +512,38 @@ class GraphArea(pg.QtGui.QWidget):
             self.emit_y_range_updated()
         # print('updated')
 
-        if self.pbar is not None:
-            self.pbar.close()
-            self.pbar = None
-
     # @timeit
     def update_layout(self):
         length = len(self.selected_depths)
         self.dock_area.setMinimumSize(0, length * self.min_plot_height)
 
-        # Progress bar update
-        if self.pbar is not None:
-            self.pbar.set_description('Populating visual elements')
-
         for depth in sorted(self.selected_depths.iterkeys(), reverse=True):
             dock = self.selected_depths[depth]
             self.dock_area.addDock(dock, position='bottom')
 
-            if self.pbar is not None:
-                self.pbar.update(1)
-
-    def add_plot_dock(self, depth, widget):
+    def add_plot_dock(self, depth):
+        # Recycled docks only need their depth, data is rebound by update_plots
+        if self.free_docks:
+            dock = self.free_docks.pop()
+            dock.reuse(depth)
+        else:
+            dock = self.create_plot_dock(depth)
+        self.selected_depths[depth] = dock
+
+    # Detach a dock from the area and keep it for the next selection
+    def remove_plot_dock(self, depth):
+        dock = self.selected_depths.pop(depth)
+        dock.widgets[0].main_widget.recycle()
+        dock.close()
+
+        # The area only forgets docks once they are garbage collected
+        if dock.area is not None:
+            dock.area.docks.pop(dock.name(), None)
+        self.free_docks.append(dock)
+
+    def create_plot_dock(self, depth):
+        # Wrap the widget in a dock
+        widget = GUI.DefaultPlotWidget(self.src)
         dock = Dock(depth, size=(1,1), closable=False, autoOrientation=False)
         split_dock_widget = SplitDockWidget(widget)
 
@@ -564,7 +556,7 @@ class GraphArea(pg.QtGui.QWidget):
             self.toggle_annotation.toggled.connect(split_dock_widget.toggle_second_widget)
 
         dock.addWidget(split_dock_widget)
-        self.selected_depths[depth] = dock       
+        return dock
 
     ## Emit the signals necessary to update all the plots ##
     def emit_x_range_updated(self):
@@ -594,13 +586,15 @@ class GraphArea(pg.QtGui.QWidget):
             else:
                 # Calculate current id
                 cur_id = (depth, ch_nr)
-                # Check if depth_labels already has labels
-                if cur_id not in patient.depth_labels:
-                    patient.depth_labels[cur_id] = list(labels)
-                else:
-                    for label in labels:
-                        if label not in patient.depth_labels[cur_id]:
-                            patient.depth_labels[cur_id].append(label)
+                # Add to any labels depth_labels already has
+                current = list(patient.depth_labels.get(cur_id, []))
+                for label in labels:
+                    if label not in current:
+                        current.append(label)
+                patient.set_depth_labels(cur_id, current)
+
+        # Annotation bar is part of the cached depth control layer
+        self.dc.refresh()
 
 ''' 
 Old update method
@@ -651,10 +645,17 @@ class SplitDockWidget(QtGui.QWidget):
 
     def update(self, src, patient, channel, depth):
         self.main_widget.update_values(patient, channel, depth)
-        if src.get_channel_number(channel) and settings.annotation_on:
-            self.add_second_widget(GUI.AnnotateWidget(src, patient, depth, src.get_channel_number(channel)))
-        else:
-            self.remove_second_widget()
+        channel_nr = src.get_channel_number(channel)
+        if channel_nr and settings.annotation_on:
+            # One annotation panel per dock, rebound to the displayed depth and channel
+            if self.second_widget is None:
+                self.add_second_widget(GUI.AnnotateWidget(src))
+            self.second_widget.rebind(patient, depth, channel_nr)
+            self.second_widget.show()
+        elif self.second_widget is not None:
+            # Unbound, so selections made while hidden annotate nothing
+            self.second_widget.rebind(None, None, None)
+            self.second_widget.hide()
 
     # Resize all elements to the automatic range
     def auto_range_contents(self):
@@ -73,6 +73,9 @@ class Main(QtGui.QMainWindow):
         self.init_window()
         self.show()
 
+        # Compute missing hashrates now that the window is up
+        self.widget.src.start_preprocessing()
+
     def init_window(self):
         space = QtGui.QDesktopWidget().availableGeometry()
 
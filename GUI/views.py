@@ -212,12 +212,16 @@ class Views(QtGui.QWidget):
     def update_source(self):
         path = str(
             QtGui.QFileDialog.getExistingDirectory(self, "Select Directory"))
+
+        # Stop the background work of the previous source
+        self.src.close()
         self.src = Source(path)
         self.directory_text.setText(path)
         self.widgets = []
         self.docks = []
         self.add_view()
         self.update_views()
+        self.src.start_preprocessing()
 
     # Creates a view link with 2 items or extends an existing one
     def new_link(self, view):
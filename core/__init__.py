@@ -1,3 +1,6 @@
 from source import Source
-from patient import Patient
+from patient import Patient, PatientRegistry
+from workers import WorkerPool
+from prefetch import Prefetcher
+from watcher import Watcher
 import data
@@ -0,0 +1,129 @@
+from bisect import bisect_left, bisect_right, insort
+from core.data import settings
+
+
+def depth_span(depths, top, bottom):
+    '''
+    First and last position of depths (sorted descending) within top to bottom
+    '''
+    low, high = 0, len(depths)
+    while low < high:
+        mid = (low + high) // 2
+        if depths[mid] > top:
+            low = mid + 1
+        else:
+            high = mid
+    first = low
+
+    high = len(depths)
+    while low < high:
+        mid = (low + high) // 2
+        if depths[mid] >= bottom:
+            low = mid + 1
+        else:
+            high = mid
+    return first, low - 1
+
+
+class AnnotationIndex(object):
+    '''
+    Annotation markers of one channel, by position in the patient's depth list
+    Bars are runs of consecutive depths sharing a single continuous label
+    Updated per depth, so markers never need a walk over all depths
+    '''
+
+    def __init__(self, depths, items=()):
+        self.position = dict((depth, idx) for idx, depth in enumerate(depths))
+
+        # Continuous label of each depth, None without exactly one
+        self.areas = [None] * len(depths)
+
+        # Runs as parallel lists, sorted by start
+        self.starts = []
+        self.ends = []
+        self.labels = []
+
+        # Dot labels by position
+        self.dots = {}
+        self.dot_positions = []
+
+        for depth, labels in items:
+            self.set(depth, labels)
+
+    def set(self, depth, labels):
+        idx = self.position.get(depth)
+        if idx is None:
+            return
+
+        # Dot markers keep the order of the settings
+        dot = [label for label in settings.dot_labels if label in labels]
+        if dot:
+            if idx not in self.dots:
+                insort(self.dot_positions, idx)
+            self.dots[idx] = dot
+        elif idx in self.dots:
+            del self.dots[idx]
+            self.dot_positions.remove(idx)
+
+        area = [label for label in settings.continuous_labels if label in labels]
+        area = area[0] if len(area) == 1 else None
+        if area != self.areas[idx]:
+            if self.areas[idx] is not None:
+                self.remove_run(idx)
+            self.areas[idx] = area
+            if area is not None:
+                self.add_run(idx, area)
+
+    def remove_run(self, idx):
+        k = bisect_right(self.starts, idx) - 1
+        start, end, label = self.starts[k], self.ends[k], self.labels[k]
+        del self.starts[k], self.ends[k], self.labels[k]
+
+        # Split around the removed depth
+        if idx < end:
+            self.starts.insert(k, idx + 1)
+            self.ends.insert(k, end)
+            self.labels.insert(k, label)
+        if start < idx:
+            self.starts.insert(k, start)
+            self.ends.insert(k, idx - 1)
+            self.labels.insert(k, label)
+
+    def add_run(self, idx, label):
+        k = bisect_right(self.starts, idx) - 1
+        left = k >= 0 and self.ends[k] == idx - 1 and self.labels[k] == label
+        right = k + 1 < len(self.starts) and self.starts[k + 1] == idx + 1 and self.labels[k + 1] == label
+
+        # Join neighbouring runs of the same label
+        if left and right:
+            self.ends[k] = self.ends[k + 1]
+            del self.starts[k + 1], self.ends[k + 1], self.labels[k + 1]
+        elif left:
+            self.ends[k] = idx
+        elif right:
+            self.starts[k + 1] = idx
+        else:
+            self.starts.insert(k + 1, idx)
+            self.ends.insert(k + 1, idx)
+            self.labels.insert(k + 1, label)
+
+    def markers(self, low=0, high=None):
+        '''
+        Runs (start, end, label) and dots (position, labels) touching positions low to high
+        '''
+        if high is None:
+            high = len(self.areas) - 1
+
+        k = max(bisect_right(self.starts, low) - 1, 0)
+        if k < len(self.starts) and self.ends[k] < low:
+            k += 1
+
+        runs = []
+        while k < len(self.starts) and self.starts[k] <= high:
+            runs.append((self.starts[k], self.ends[k], self.labels[k]))
+            k += 1
+
+        first = bisect_left(self.dot_positions, low)
+        last = bisect_right(self.dot_positions, high)
+        dots = [(idx, self.dots[idx]) for idx in self.dot_positions[first:last]]
+        return runs, dots
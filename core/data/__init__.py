@@ -3,4 +3,12 @@ from clean_channels import CleanChannels
 from hash_function import hash_rate
 from hash_function import noise_floor
 from create_neural_audio import preprocess_audio
+from cache import DataCache
+from segmented import SegmentedArray
+from pyramid import MinMaxPyramid
+from npy_store import NpyStore
+from hash_cache import HashCache
 import global_signals
+import hash_engine
+import features
+import audio
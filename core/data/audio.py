@@ -0,0 +1,248 @@
+'''
+Streaming audio playback of recordings
+Audio is processed in blocks as the output pulls it, so playback starts immediately
+'''
+
+import threading
+import wave
+import numpy as np
+from core.data import settings
+from core.data.create_neural_audio import dilate, SPIKE_WIDTH, SPIKE_THRESHOLD, OUTPUT_SAMPLE_RATE
+
+# No audio device is needed for the null and wave sinks
+try:
+    import sounddevice as sd
+except (ImportError, OSError):
+    sd = None
+
+
+# Samples read at a time, lazy data is never read in full
+STATS_CHUNK = 2 ** 20
+
+def audio_stats(data, chunk=STATS_CHUNK):
+    '''
+    Mean, peak and standard deviation used to scale and gate a recording
+    '''
+    data = data.squeeze()
+
+    # Chunk means and squared deviations are combined pairwise
+    count, mean, m2 = 0, 0., 0.
+    low, high = np.inf, -np.inf
+    for start in range(0, len(data), chunk):
+        block = np.asarray(data[start:start + chunk], dtype=np.float64)
+        block_mean = block.mean()
+        delta = block_mean - mean
+        total = count + block.size
+        mean += delta * block.size / total
+        m2 += ((block - block_mean) ** 2).sum() + delta ** 2 * count * block.size / total
+        count = total
+        low, high = min(low, block.min()), max(high, block.max())
+
+    peak = max(abs(high - mean), abs(low - mean))
+    return (mean, peak, np.sqrt(m2 / count))
+
+
+class AudioStream(object):
+    '''
+    Same output as preprocess_audio, resampled from freq to rate and read in blocks
+    '''
+
+    def __init__(self, data, freq, rate, spikes_only=False, spike_threshold=SPIKE_THRESHOLD, stats=None):
+        self.data = data.squeeze()
+        self.length = len(self.data)
+        self.freq = float(freq)
+        self.rate = float(rate)
+        self.spikes_only = spikes_only
+        self.spike_threshold = spike_threshold
+
+        if stats is None:
+            stats = audio_stats(self.data)
+        self.mean, self.peak, self.sd = stats
+
+        # Same gating window as preprocess_audio
+        spike_bin = int(OUTPUT_SAMPLE_RATE*SPIKE_WIDTH/2)
+        self.radius = spike_bin*(spike_bin + 1)//2
+
+        # Recording samples per output frame
+        self.ratio = self.freq / self.rate
+        self.frames = int((self.length - 1) / self.ratio) + 1 if self.length else 0
+
+        # Next output frame to read
+        self.frame = 0
+
+    def seconds(self, frame):
+        return frame / self.rate
+
+    def process(self, start, stop):
+        '''
+        Scaled and gated recording samples in [start, stop)
+        '''
+        if not self.spikes_only:
+            return (np.asarray(self.data[start:stop]) - self.mean) / self.peak
+
+        # Gating needs the samples within the window around the block
+        low = max(start - self.radius, 0)
+        high = min(stop + self.radius, self.length)
+        data = np.asarray(self.data[low:high]) - self.mean
+        thresh = self.sd*self.spike_threshold
+        keep = dilate(np.logical_or(data > thresh, data < -thresh), self.radius)
+
+        output = data[start - low:stop - low] / self.peak
+        output[~keep[start - low:stop - low]] = 0
+        return output
+
+    def read(self, frames):
+        '''
+        Next block of at most frames output frames, empty once the recording ends
+        '''
+        start = self.frame
+        stop = min(start + frames, self.frames)
+        if stop <= start:
+            return np.zeros(0, dtype=np.float32)
+
+        if self.ratio == 1:
+            block = self.process(start, stop)
+        else:
+            # Linear interpolation between neighbouring recording samples
+            positions = np.arange(start, stop) * self.ratio
+            low = int(positions[0])
+            high = min(int(positions[-1]) + 2, self.length)
+            block = np.interp(positions, np.arange(low, high), self.process(low, high))
+
+        self.frame = stop
+        return block.astype(np.float32)
+
+
+class DeviceSink(object):
+    '''
+    Plays a stream on the default output device from the audio callback
+    '''
+
+    def __init__(self, samplerate=None, blocksize=settings.audio_blocksize):
+        if samplerate is None:
+            samplerate = sd.query_devices(kind='output')['default_samplerate']
+        self.samplerate = samplerate
+        self.blocksize = blocksize
+        self.output = None
+        self.stream = None
+
+        # Frames written before the last block and the time that block is heard
+        self.timing = (0, None)
+        self.written = 0
+
+    def start(self, stream):
+        self.stop()
+        self.stream = stream
+        self.written = 0
+        self.timing = (0, None)
+        self.output = sd.OutputStream(
+            samplerate=self.samplerate, blocksize=self.blocksize,
+            channels=1, dtype='float32', callback=self.callback)
+        self.output.start()
+
+    def callback(self, outdata, frames, time, status):
+        block = self.stream.read(frames)
+        outdata[:block.size, 0] = block
+        outdata[block.size:, 0] = 0
+
+        self.timing = (self.written, time.outputBufferDacTime)
+        self.written += block.size
+        if block.size < frames:
+            raise sd.CallbackStop
+
+    def position(self):
+        '''
+        Output frame currently being heard
+        '''
+        written, dac_time = self.timing
+        if dac_time is None or self.output is None:
+            return 0
+        frame = written + (self.output.time - dac_time) * self.samplerate
+        return int(min(max(frame, 0), self.stream.frames))
+
+    def active(self):
+        return self.output is not None and self.output.active
+
+    def stop(self):
+        if self.output is not None:
+            self.output.stop()
+            self.output.close()
+            self.output = None
+
+
+class NullSink(object):
+    '''
+    Consumes a stream without a device, advanced by calling step
+    '''
+
+    def __init__(self, samplerate=OUTPUT_SAMPLE_RATE, blocksize=settings.audio_blocksize):
+        self.samplerate = samplerate
+        self.blocksize = blocksize
+        self.stream = None
+        self.written = 0
+        self.running = False
+
+    def start(self, stream):
+        self.stream = stream
+        self.written = 0
+        self.running = True
+
+    def step(self, frames=None):
+        block = self.stream.read(frames or self.blocksize)
+        self.written += block.size
+        if block.size < (frames or self.blocksize):
+            self.running = False
+        return block
+
+    def position(self):
+        return self.written
+
+    def active(self):
+        return self.running
+
+    def stop(self):
+        self.running = False
+
+
+class WaveSink(NullSink):
+    '''
+    Writes a stream to a 16 bit wave file in the background
+    '''
+
+    def __init__(self, path=settings.audio_wave_path, samplerate=OUTPUT_SAMPLE_RATE, blocksize=settings.audio_blocksize):
+        super(WaveSink, self).__init__(samplerate, blocksize)
+        self.path = path
+        self.thread = None
+
+    def start(self, stream):
+        super(WaveSink, self).start(stream)
+        self.thread = threading.Thread(target=self.write)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self):
+        out = wave.open(self.path, 'wb')
+        try:
+            out.setnchannels(1)
+            out.setsampwidth(2)
+            out.setframerate(int(self.samplerate))
+            while self.running:
+                block = self.step()
+                out.writeframes((np.clip(block, -1, 1) * 32767).astype('<i2').tobytes())
+        finally:
+            out.close()
+
+    def join(self):
+        if self.thread is not None:
+            self.thread.join()
+
+
+def make_sink():
+    '''
+    Output selected by settings.audio_sink
+    '''
+    if settings.audio_sink == 'null':
+        return NullSink()
+    if settings.audio_sink == 'wave':
+        return WaveSink()
+    return DeviceSink()
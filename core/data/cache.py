@@ -0,0 +1,174 @@
+'''
+Bounded least recently used cache for loaded recordings
+'''
+
+from collections import OrderedDict
+import threading
+import numpy as np
+
+
+# Size in bytes of all arrays held by a cache entry
+# Memory mapped and lazy entries are charged their full size, so that they are
+# evicted like loaded arrays instead of keeping a mapping or file handle open
+def entry_nbytes(data):
+    if isinstance(data, np.ndarray):
+        return data.nbytes
+    # SegmentedArray, MinMaxPyramid and lazy v7.3 datasets report their own size
+    if hasattr(data, 'nbytes'):
+        return data.nbytes
+    if isinstance(data, dict):
+        return sum(entry_nbytes(value) for value in data.values())
+    if isinstance(data, (list, tuple)):
+        return sum(entry_nbytes(value) for value in data)
+    return 0
+
+
+# Release file handles and loaded segments of a removed entry
+# Memory maps are unmapped once the last view is dropped, closing them could break views
+def close_entry(data):
+    if isinstance(data, np.ndarray):
+        return
+    if hasattr(data, 'close'):
+        data.close()
+    elif isinstance(data, dict):
+        for value in data.values():
+            close_entry(value)
+    elif isinstance(data, (list, tuple)):
+        for value in data:
+            close_entry(value)
+
+
+class DataCache(object):
+    '''
+    Dict-like cache with a memory budget in bytes
+    Entries are evicted least recently used first, pinned entries are kept
+    Safe to share with background loading threads
+    '''
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.lock = threading.RLock()
+
+        # Ordered from least to most recently used
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.nbytes = 0
+
+        # Pin counts, entries displayed in several docks are pinned several times
+        self.pinned = {}
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.touch(key)
+                return True
+            self.misses += 1
+            return False
+
+    def __getitem__(self, key):
+        with self.lock:
+            value = self.entries[key]
+            self.touch(key)
+            return value
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+
+            size = entry_nbytes(value)
+            self.entries[key] = value
+            self.sizes[key] = size
+            self.nbytes += size
+
+            # Never evict the entry we just stored
+            self.evict(keep=key)
+
+    def __delitem__(self, key):
+        with self.lock:
+            self.remove(key)
+
+    def __len__(self):
+        return len(self.entries)
+
+    # Lookup that cannot race with eviction between a check and a read
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.touch(key)
+                return self.entries[key]
+            self.misses += 1
+            return default
+
+    def keys(self):
+        with self.lock:
+            return list(self.entries.keys())
+
+    # Mark entry as most recently used
+    def touch(self, key):
+        self.entries[key] = self.entries.pop(key)
+
+    def remove(self, key):
+        close_entry(self.entries.pop(key))
+        self.nbytes -= self.sizes.pop(key)
+
+    def evict(self, keep=None):
+        with self.lock:
+            if self.nbytes <= self.max_bytes:
+                return
+
+            for key in list(self.entries.keys()):
+                if self.nbytes <= self.max_bytes:
+                    break
+
+                # Entries without arrays don't free anything
+                if key == keep or key in self.pinned or not self.sizes[key]:
+                    continue
+
+                self.remove(key)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            for value in self.entries.values():
+                close_entry(value)
+            self.entries.clear()
+            self.sizes.clear()
+            self.nbytes = 0
+
+    '''
+    Pinning of entries currently on display
+    '''
+
+    def pin(self, key):
+        with self.lock:
+            self.pinned[key] = self.pinned.get(key, 0) + 1
+
+    def unpin(self, key):
+        with self.lock:
+            if key not in self.pinned:
+                return
+
+            self.pinned[key] -= 1
+            if self.pinned[key] <= 0:
+                del self.pinned[key]
+
+                # Budget may have been exceeded while pinned
+                self.evict()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'nbytes': self.nbytes,
+                'max_bytes': self.max_bytes}
@@ -1,7 +1,5 @@
 from scipy.io import loadmat
 import numpy as np
-import sounddevice as sd
-from time import time
 from core.data import settings
 
 # Constants
@@ -23,22 +21,31 @@ def preprocess_audio(data, freq=OUTPUT_SAMPLE_RATE, spikes_only=False, spike_thr
 		keep = np.logical_or(data > sd*spike_threshold, data < -sd*spike_threshold).squeeze()
 
 		# Grab everything within a spike bin
-		for idx in np.arange(-spike_bin, spike_bin + 1):
-			if idx < 0:
-				keep = np.logical_or(keep, np.pad(keep[-idx:], (0,-idx), 'constant', constant_values=(0)))
-			elif idx > 0:
-				keep = np.logical_or(keep, np.pad(keep[:-idx], (idx,0), 'constant', constant_values=(0)))
+		# The original loop dilated its own output, which grows the bin to 1+2+...+spike_bin samples
+		keep = dilate(keep, spike_bin*(spike_bin + 1)//2)
 
 		output[~keep] = 0
 
 	return output
 
-# x = time()
-# file = loadmat('spikedata.mat')
-# data = file['CSPK_1___02']
-
-# print('Time to load data: %f' % (time() - x))
-# y = time()
-# output = preprocess_audio(data, spikes_only=False)
-# print('Time to process data: %f' % (time() - y))
-# sd.play(output)
+# Mark every sample within radius of a marked sample, in linear time
+# Overlapping windows are merged into runs, run edges toggle the mask
+def dilate(keep, radius):
+	size = keep.size
+	marked = np.flatnonzero(keep)
+	edges = np.zeros(size + 1, dtype=bool)
+	if marked.size == 0:
+		return edges[:size]
+
+	starts = np.maximum(marked - radius, 0)
+	ends = np.minimum(marked + radius + 1, size)
+
+	# A run starts where a window does not overlap the previous one
+	first = np.ones(marked.size, dtype=bool)
+	first[1:] = starts[1:] > ends[:-1]
+	last = np.ones(marked.size, dtype=bool)
+	last[:-1] = first[1:]
+
+	edges[starts[first]] = True
+	edges[ends[last]] = True
+	return np.logical_xor.accumulate(edges)[:size]
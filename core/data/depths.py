@@ -1,10 +1,29 @@
 import re
+from core.data import settings
 
-# Default parse scheme for current files on DriveOne
-def default_parse(filename):
+# Filename parsers by site, selected with settings.filename_parser
+PARSERS = {}
+
+def regex_parser(pattern):
+    '''
+    Parser from a regexp with named groups 'depth' and 'file', compiled once
+    '''
+    compiled = re.compile(pattern)
+
+    def parse(filename):
+        match = compiled.match(filename)
+        if match is not None:
+            return (match.group('depth'), match.group('file'))
+        return (None, None)
+    return parse
 
-    depth_regexp = '([lr]t[0-9]d|[LR]T[0-9]D)([-.0-9]+)F([0-9]+)'
-    depth = re.match(depth_regexp, filename)
-    if depth is not None:
-        return (depth.group(2), depth.group(3))
-    return (None, None)
+def register_parser(name, parser):
+    PARSERS[name] = parser
+    return parser
+
+def get_parser(name=None):
+    return PARSERS[name or settings.filename_parser]
+
+# Default parse scheme for current files on DriveOne
+default_parse = register_parser('default',
+    regex_parser('([lr]t[0-9]d|[LR]T[0-9]D)(?P<depth>[-.0-9]+)F(?P<file>[0-9]+)'))
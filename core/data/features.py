@@ -0,0 +1,81 @@
+'''
+Per depth features of a patient, stored as columns of a single npz file
+Every row is a (channel, depth) pair, features missing for a row are nan
+'''
+
+import os
+import numpy as np
+
+
+# Columns identifying a row, every other column is a feature
+KEY_COLUMNS = ('channel', 'depth')
+
+
+def load_columns(filepath):
+    data = np.load(filepath)
+    try:
+        return dict((name, data[name]) for name in data.files)
+    finally:
+        data.close()
+
+
+def save_columns(filepath, columns):
+    folder = os.path.dirname(filepath)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    np.savez(filepath, **columns)
+
+
+def hashrate_columns(hashes):
+    '''
+    Columns from {channel: [depth, rate, depth, rate, ...]}
+    '''
+    channels = []
+    depths = []
+    rates = []
+    for channel, values in sorted(hashes.items()):
+        channels.extend([channel] * (len(values) // 2))
+        depths.extend(values[0::2])
+        rates.extend(values[1::2])
+
+    return {
+        'channel': np.array(channels, dtype=str),
+        'depth': np.array(depths, dtype=float),
+        'hashrate': np.array(rates, dtype=float)}
+
+
+def merge_columns(old, new):
+    '''
+    Rows and features of new replace those of old, other features are kept
+    '''
+    rows = {}
+    for columns in (old, new):
+        for key in zip(columns['channel'], columns['depth']):
+            rows.setdefault(key, len(rows))
+
+    merged = {
+        'channel': np.array([key[0] for key in sorted(rows, key=rows.get)], dtype=str),
+        'depth': np.array([key[1] for key in sorted(rows, key=rows.get)], dtype=float)}
+
+    for columns in (old, new):
+        positions = [rows[key] for key in zip(columns['channel'], columns['depth'])]
+        for name, values in columns.items():
+            if name in KEY_COLUMNS:
+                continue
+            if name not in merged or columns is new:
+                merged[name] = np.full(len(rows), np.nan)
+            merged[name][positions] = values
+
+    return merged
+
+
+def read_hashrate_csv(filepath):
+    '''
+    Legacy channel,depth,rate,depth,rate,... rows
+    '''
+    hashes = {}
+    with open(filepath, 'r') as csvfile:
+        for line in csvfile:
+            current = line.splitlines()[0].split(',')
+            hashes[current[0]] = [float(value) for value in current[1:]]
+    return hashes
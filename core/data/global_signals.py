@@ -10,3 +10,9 @@ class SourceSignal(QtCore.QObject):
 
 	# Update depth control
 	repaint_dc = QtCore.pyqtSignal()
+
+	# Hashrates computed in the background for a patient
+	hashrates_updated = QtCore.pyqtSignal(str)
+
+	# New recordings registered for a patient
+	depths_added = QtCore.pyqtSignal(str)
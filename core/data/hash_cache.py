@@ -0,0 +1,172 @@
+'''
+Content and parameter keyed storage of per depth hashrate summaries
+'''
+
+import os
+import json
+import hashlib
+import numpy as np
+from core.data import settings
+from core.data import hash_function
+from core.data.hash_engine import SUMMARY_FRACTION
+
+
+# Read size for content hashing
+CHUNK_SIZE = 1024 ** 2
+
+# Lookup of file content hashes by file stats
+INDEX_NAME = 'index.json'
+
+
+def params():
+    '''
+    All parameters that change hashrate results
+    '''
+    return {
+        'HASH_VERSION': hash_function.HASH_VERSION,
+        'HASH_THRESH_SD': hash_function.HASH_THRESH_SD,
+        'TARGET': hash_function.TARGET,
+        'DEAD_TIME_MS': hash_function.DEAD_TIME_MS,
+        'THRESH_HIGH': hash_function.THRESH_HIGH,
+        'DEPTH_RANGE': list(hash_function.DEPTH_RANGE),
+        'MIN_RECORD_DURATION': hash_function.MIN_RECORD_DURATION,
+        'APPROX_SAMPLES': hash_function.APPROX_SAMPLES,
+        'SUMMARY_FRACTION': SUMMARY_FRACTION,
+        'approximate_noise_floor': settings.approximate_noise_floor,
+        'data_hz': settings.data_hz}
+
+
+def params_key():
+    text = json.dumps(params(), sort_keys=True)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+
+
+class HashCache(object):
+    '''
+    Summaries are stored as <path>/<params key>/<unit key>.npz
+    Each parameter set has its own folder, so several can coexist
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.key = params_key()
+        self.folder = os.path.join(path, self.key)
+        self.index = None
+
+    def ensure_folder(self):
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+            # Describe the parameter set for whoever browses the folder
+            with open(os.path.join(self.folder, 'params.json'), 'w') as f:
+                json.dump(params(), f, sort_keys=True, indent=1)
+
+    '''
+    File keys
+    '''
+
+    def load_index(self):
+        if self.index is None:
+            path = os.path.join(self.path, INDEX_NAME)
+            if os.path.isfile(path):
+                with open(path, 'r') as f:
+                    self.index = json.load(f)
+            else:
+                self.index = {}
+        return self.index
+
+    def save_index(self):
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        with open(os.path.join(self.path, INDEX_NAME), 'w') as f:
+            json.dump(self.load_index(), f)
+
+    def file_stats(self, filepath):
+        stat = os.stat(filepath)
+        return [stat.st_size, stat.st_mtime]
+
+    def file_digest(self, filepath):
+        '''
+        Content hash of a file, only recomputed when size or mtime change
+        '''
+        index = self.load_index()
+        stats = self.file_stats(filepath)
+        entry = index.get(filepath)
+        if entry is not None and entry['stats'] == stats:
+            return entry['digest']
+
+        sha = hashlib.sha1()
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                sha.update(chunk)
+
+        index[filepath] = {'stats': stats, 'digest': sha.hexdigest()}
+        return index[filepath]['digest']
+
+    def unit_key(self, files, depth, channels):
+        digests = [self.file_digest(f) for f in files]
+        text = json.dumps([digests, depth, list(channels)])
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    '''
+    Summaries
+    '''
+
+    def load(self, unit_key):
+        '''
+        (floors, summaries) of a depth as returned by hash_engine.summarize_unit
+        '''
+        path = os.path.join(self.folder, unit_key + '.npz')
+        if not os.path.isfile(path):
+            return None
+
+        data = np.load(path)
+        floors = list(data['floors'])
+        summaries = []
+        for idx, (length, bound) in enumerate(zip(data['lengths'], data['bounds'])):
+            if length == 0:
+                summaries.append((0, bound, None, None))
+            else:
+                summaries.append((int(length), bound, data['indices_%d' % idx], data['values_%d' % idx]))
+        return (floors, summaries)
+
+    def save(self, unit_key, result):
+        floors, summaries = result
+        arrays = {
+            'floors': np.array(floors, dtype=float),
+            'lengths': np.array([s[0] for s in summaries], dtype=np.int64),
+            'bounds': np.array([s[1] for s in summaries], dtype=float)}
+        for idx, (length, bound, indices, values) in enumerate(summaries):
+            if length != 0:
+                arrays['indices_%d' % idx] = indices
+                arrays['values_%d' % idx] = values
+
+        self.ensure_folder()
+        np.savez(os.path.join(self.folder, unit_key + '.npz'), **arrays)
+
+    '''
+    Patient manifests, to skip unchanged patients without reading anything
+    '''
+
+    def manifest_path(self, patient):
+        return os.path.join(self.folder, 'manifest_%s.json' % patient.name)
+
+    def patient_stats(self, patient, files_list=None):
+        if files_list is None:
+            files_list = patient.files
+        return dict((f, self.file_stats(f)) for files in files_list for f in files)
+
+    def is_current(self, patient):
+        path = self.manifest_path(patient)
+        if not os.path.isfile(path):
+            return False
+        with open(path, 'r') as f:
+            return json.load(f) == self.patient_stats(patient)
+
+    def save_manifest(self, patient, files_list=None):
+        '''
+        files_list defaults to the current files, pass the ones the hashrates were computed from
+        '''
+        self.ensure_folder()
+        with open(self.manifest_path(patient), 'w') as f:
+            json.dump(self.patient_stats(patient, files_list), f)
@@ -0,0 +1,191 @@
+'''
+Process pool engine for hashrate preprocessing
+Each file is read once, results match the serial computation
+'''
+
+import multiprocessing
+from collections import deque
+import numpy as np
+from tqdm import tqdm
+from core.data import settings
+from core.data import loading
+from core.data.npy_store import NpyStore
+from core.data import hash_function
+
+
+# Crossing candidates are kept down to this fraction of a file's own noise floor
+SUMMARY_FRACTION = .5
+
+# Converted recording stores opened in this process
+_stores = {}
+
+
+def read_unit(patient, files, channels, store_path):
+    store = None
+    if store_path is not None:
+        if store_path not in _stores:
+            _stores[store_path] = NpyStore(store_path)
+        store = _stores[store_path]
+
+    return loading.read_channels(files, channels, store, patient)
+
+
+def summarize_unit(unit):
+    '''
+    Noise floors and hash summaries of all spike channels of one depth
+    '''
+    patient, files, depth, channels, store_path = unit
+    data = read_unit(patient, files, channels, store_path)
+    data = [np.asarray(data[channel]).squeeze() for channel in channels]
+
+    floors = hash_function.noise_floors(
+        data, settings.data_hz, depth, approx=settings.approximate_noise_floor)
+
+    summaries = []
+    for values, floor in zip(data, floors):
+        if np.isnan(floor):
+            summaries.append(hash_function.hash_summary(values, settings.data_hz, depth, np.inf))
+        else:
+            summaries.append(hash_function.hash_summary(values, settings.data_hz, depth, floor * SUMMARY_FRACTION))
+
+    return (floors, summaries)
+
+
+def hash_rate_unit(args):
+    unit, channel, thresh = args
+    patient, files, depth, channels, store_path = unit
+    data = read_unit(patient, files, [channel], store_path)[channel]
+    return hash_function.hash_rate(data, settings.data_hz, depth, thresh)
+
+
+def make_pool():
+    '''
+    Process pool for hashrate preprocessing, None to run serially
+    Forked children inherit locks held by other threads (Qt, h5py, worker pool) and can
+    deadlock on them, so the pool is spawned where supported and otherwise has to be
+    created on the main thread before any background threads start
+    '''
+    processes = settings.hashrate_processes or multiprocessing.cpu_count()
+    if processes <= 1:
+        return None
+    if hasattr(multiprocessing, 'get_context'):
+        return multiprocessing.get_context('spawn').Pool(processes)
+    return multiprocessing.Pool(processes)
+
+
+def unit_nbytes(unit):
+    '''
+    Memory of the channels of one depth once decoded as float64
+    '''
+    patient, files, depth, channels, store_path = unit
+    lengths = 0
+    for filepath in files:
+        lengths += sum(length for length, dtype in loading.channel_shapes(filepath, channels).values())
+    return lengths * 8
+
+
+def in_flight(pool, units):
+    '''
+    Number of units processed at once, limited so that decoded data stays within budget
+    '''
+    if pool is None or len(units) <= 1:
+        return 1
+    processes = min(settings.hashrate_processes or multiprocessing.cpu_count(), len(units))
+
+    # Each process holds one depth worth of data at a time
+    largest = max(unit_nbytes(unit) for unit in units)
+    if largest > 0:
+        budget = settings.hashrate_memory * 1024 ** 2
+        processes = min(processes, max(1, int(budget // largest)))
+
+    return processes
+
+
+def run_units(pool, func, units, desc, limit=1):
+    with tqdm(total=len(units), desc=desc) as pbar:
+        results = []
+        if pool is None or limit <= 1:
+            # A single unit at a time, as when the watcher adds a file, runs inline
+            for unit in units:
+                results.append(func(unit))
+                pbar.update()
+            return results
+
+        # At most limit units in flight, results are collected in order
+        pending = deque()
+        for unit in units:
+            pending.append(pool.apply_async(func, (unit,)))
+            if len(pending) >= limit:
+                results.append(pending.popleft().get())
+                pbar.update()
+        while pending:
+            results.append(pending.popleft().get())
+            pbar.update()
+    return results
+
+
+def compute_hashrates(patient, spike_channels, store_path=None, cache=None, recordings=None, pool=None):
+    '''
+    Hashrates of every depth for each channel
+    Summaries found in cache are reused, only new or changed depths are read
+    Depths are spread over pool (see make_pool) if given, and read serially otherwise
+    Returns {channel: [depth, rate, depth, rate, ...]}
+    '''
+    # Read once, depths and files may be replaced by the watcher meanwhile
+    if recordings is None:
+        recordings = patient.recordings
+    depths, files_list = recordings
+    units = [(patient.name, files, depth, spike_channels, store_path)
+             for depth, files in zip(depths, files_list)]
+
+    # Look up previous summaries
+    results = [None] * len(units)
+    keys = [None] * len(units)
+    if cache is not None:
+        for idx, unit in enumerate(units):
+            keys[idx] = cache.unit_key(unit[1], unit[2], spike_channels)
+            results[idx] = cache.load(keys[idx])
+    missing = [idx for idx, result in enumerate(results) if result is None]
+
+    if settings.approximate_noise_floor:
+        print('Approximate noise floor, quantile ranks within +-%.2f%% (%d%% confidence)' % (
+            hash_function.quantile_error() * 100, hash_function.APPROX_CONFIDENCE * 100))
+
+    # Single pass over new files, only small summaries are kept
+    pending = [units[idx] for idx in missing]
+    computed = run_units(pool, summarize_unit, pending, 'Summarizing', in_flight(pool, pending))
+    for idx, result in zip(missing, computed):
+        results[idx] = result
+        if cache is not None:
+            cache.save(keys[idx], result)
+    if cache is not None:
+        cache.save_index()
+
+    # Compute noisefloor
+    noise_floor = {}
+    for idx, channel in enumerate(spike_channels):
+        noise_floor[channel] = np.nanmedian([floors[idx] for floors, _ in results])
+
+    # Compute hashrates from the summaries
+    hashes = {}
+    reload = []
+    for idx, channel in enumerate(spike_channels):
+        hashes[channel] = []
+        for unit, (_, summaries) in zip(units, results):
+            rate = hash_function.hash_rate_from_summary(
+                summaries[idx], settings.data_hz, noise_floor[channel])
+
+            # Threshold below what the summary covers, read the file again
+            if rate is None:
+                reload.append((len(hashes[channel]) + 1, (unit, channel, noise_floor[channel])))
+
+            hashes[channel].append(unit[2])
+            hashes[channel].append(rate)
+
+    if reload:
+        pending = [args for _, args in reload]
+        rates = run_units(pool, hash_rate_unit, pending, 'Reloading', in_flight(pool, [args[0] for args in pending]))
+        for (position, args), rate in zip(reload, rates):
+            hashes[args[1]][position] = rate
+
+    return hashes
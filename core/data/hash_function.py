@@ -9,6 +9,10 @@ HASH_THRESH_SD = 5; # number of standard dev above the noise floor for hash dete
 # Noise floor parameters
 TARGET = .159 # one standard deviation will have 0.159 values greater and 0.159 values lesser
 
+# Version of the hashrate algorithm, increase whenever results change for the same parameters
+# Stored results are keyed by it, see core/data/hash_cache.py
+HASH_VERSION = 1
+
 # Hash rate parameters
 DEAD_TIME_MS = 0.3
 THRESH_HIGH = True # Set to false for low threshold
@@ -18,15 +22,120 @@ DEPTH_RANGE = [-5, 10]
 # In seconds
 MIN_RECORD_DURATION = .5
 
-# Return a threshold based on # of standard deviations multiplied on noise floor
-def noise_floor(data, freq, depth, sd=HASH_THRESH_SD):
+# Data too short or outside the depth range is not used
+def valid_record(data, freq, depth):
 	if data.size <= 1 or len(data.squeeze())/float(freq) < MIN_RECORD_DURATION or depth < DEPTH_RANGE[0] or depth > DEPTH_RANGE[1]:
+		return False
+	return True
+
+# Approximate noise floor parameters
+APPROX_SAMPLES = 200000 # random samples used to estimate the quantiles
+APPROX_CONFIDENCE = .99
+
+# Positions of the noise floor quantiles in sorted data
+def quantile_positions(length):
+	return [int(np.round(length*TARGET)), int(np.round(length*(1-TARGET)))]
+
+# Values at positions x1 < x2 of the sorted data along the last axis, in linear time
+def select_quantiles(data, x1, x2):
+	data = np.partition(data, x1, axis=-1)
+	upper = np.partition(data[..., x1+1:], x2-x1-1, axis=-1)
+	return data[..., x1], upper[..., x2-x1-1]
+
+# Random sample positions for the approximate mode, fixed seed for repeatable results
+def sample_positions(length):
+	return np.random.RandomState(0).randint(0, length, APPROX_SAMPLES)
+
+# Error bound of the approximate mode (Dvoretzky-Kiefer-Wolfowitz)
+# Estimated quantiles lie within +- this fraction of ranks of the exact ones
+def quantile_error(samples=APPROX_SAMPLES, confidence=APPROX_CONFIDENCE):
+	return np.sqrt(np.log(2 / (1 - confidence)) / (2. * samples))
+
+# Return a threshold based on # of standard deviations multiplied on noise floor
+# Quantiles are selected in linear time, approx estimates them from a random subsample
+def noise_floor(data, freq, depth, sd=HASH_THRESH_SD, approx=False):
+	if not valid_record(data, freq, depth):
 		return np.nan
-	data = np.sort(np.array(data).squeeze())
-	x1, x2 = [int(np.round(len(data)*TARGET)), int(np.round(len(data)*(1-TARGET)))]
-	noisefloor = [data[x1], data[x2]]
+	data = np.asarray(data).squeeze()
+	if approx and len(data) > APPROX_SAMPLES:
+		data = data[sample_positions(len(data))]
+	x1, x2 = quantile_positions(len(data))
+	noisefloor = select_quantiles(data, x1, x2)
 	return np.abs(noisefloor).mean() * sd
 
+# Noise floors of several channels, equal length channels are computed in one call
+def noise_floors(channels, freq, depth, sd=HASH_THRESH_SD, approx=False):
+	floors = [np.nan] * len(channels)
+
+	# Group valid channels by length
+	groups = {}
+	for idx, data in enumerate(channels):
+		if valid_record(data, freq, depth):
+			groups.setdefault(len(data), []).append(idx)
+
+	for length, indices in groups.items():
+		data = np.vstack([channels[idx] for idx in indices])
+		if approx and length > APPROX_SAMPLES:
+			data = data[:, sample_positions(length)]
+		x1, x2 = quantile_positions(data.shape[1])
+		values = np.abs(np.column_stack(select_quantiles(data, x1, x2))).mean(axis=1) * sd
+		for idx, value in zip(indices, values):
+			floors[idx] = value
+
+	return floors
+
+# Boolean array of values that pass threshold
+def threshold(data, thresh):
+	if THRESH_HIGH:
+		return data > thresh
+	else:
+		return data < -thresh
+
+# Crossings kept by a dead time filter
+# A crossing is kept if it comes at least dead_samples after the last kept crossing
+# Kept crossings are the chain of following crossings from the first one, which is
+# walked by doubling jumps in a logarithmic number of array operations
+def dead_time_mask(crossed_ind, dead_samples):
+	size = crossed_ind.size
+	keep = np.zeros(size, dtype=bool)
+	if size == 0:
+		return keep
+	if not dead_samples > 0:
+		keep[:] = True
+		return keep
+
+	# Position of the crossing kept after each crossing, size past the last one
+	following = np.searchsorted(crossed_ind, crossed_ind + dead_samples, side='left')
+	following = np.append(following, size)
+
+	# jumps[k] is the position 2**k kept crossings ahead, until that leaves the first chain
+	jumps = [following]
+	while jumps[-1][0] < size:
+		jumps.append(jumps[-1][jumps[-1]])
+
+	# Position of the n-th kept crossing for every n the chain can reach
+	steps = np.arange(2 ** (len(jumps) - 1))
+	positions = np.zeros(steps.size, dtype=following.dtype)
+	for k, jump in enumerate(jumps):
+		step = (steps >> k) & 1 == 1
+		positions[step] = jump[positions[step]]
+
+	keep[positions[positions < size]] = True
+	return keep
+
+# Eliminate all threshold crossings within the dead interval
+# Same result as the original loop, which passed the eliminated sample indices to
+# np.delete as positions. Indices past the last position were ignored (numpy < 1.19)
+# so mostly nothing is removed, changing this changes all stored hashrates
+def dead_time_filter(crossed_ind, dead_samples):
+	size = crossed_ind.size
+	elim = crossed_ind[~dead_time_mask(crossed_ind, dead_samples)]
+	elim = elim[(elim >= 0) & (elim < size)]
+
+	keep = np.ones(size, dtype=bool)
+	keep[elim] = False
+	return crossed_ind[keep]
+
 # Calculate the hashrate
 def hash_rate(data, freq, depth, thresh):
 	# Default rate of 0
@@ -35,17 +144,14 @@ def hash_rate(data, freq, depth, thresh):
 	data = np.array(data).squeeze()
 
 	# Currently only limiting for depth, not minium record duration
-	if data.size <= 1 or len(data.squeeze())/float(freq) < MIN_RECORD_DURATION or depth < DEPTH_RANGE[0] or depth > DEPTH_RANGE[1]:
+	if not valid_record(data, freq, depth):
 		return rate
 
 	# Dead time samples
 	dead_samples = DEAD_TIME_MS * freq / 1000
 
 	# Boolean array of values that pass threshold
-	if THRESH_HIGH:
-		crossed = data > thresh
-	else:
-		crossed = data < -thresh
+	crossed = threshold(data, thresh)
 
 	# Boolean operation with arrays to find all crosses
 	crossed[1:][crossed[:-1] & crossed[1:]] = False	
@@ -56,19 +162,47 @@ def hash_rate(data, freq, depth, thresh):
 
 	# If we find crossings
 	if crossed_ind.size != 0:
-		# Eliminate all threshold crossings within the dead interval
-		elim = []
+		crossed_ind = dead_time_filter(crossed_ind, dead_samples)
 
-		last_ind = crossed_ind[0]
-		for ind in crossed_ind[1:]:
-			if ind - last_ind < dead_samples:
-				elim.append(ind)
-			else:
-				last_ind = ind
+		rate = len(crossed_ind) / (len(crossed) / float(freq))
 
-		crossed_ind = np.delete(crossed_ind, elim)
+	return rate
 
-		rate = len(crossed_ind) / (len(crossed) / float(freq))
+# Summary of a record holding every sample that passes bound
+# Enough to compute hash_rate for any threshold of at least bound
+def hash_summary(data, freq, depth, bound):
+	data = np.array(data).squeeze()
+	if not valid_record(data, freq, depth):
+		return (0, bound, None, None)
+
+	indices = np.where(threshold(data, bound))[0]
+	return (len(data), bound, indices, data[indices])
+
+# Same result as hash_rate, None if the summary does not cover the threshold
+def hash_rate_from_summary(summary, freq, thresh):
+	length, bound, indices, values = summary
+
+	# Invalid records have a rate of 0
+	if length == 0:
+		return 0
+	if not thresh >= bound:
+		return None
+
+	dead_samples = DEAD_TIME_MS * freq / 1000
+
+	# Samples not in the summary cannot pass the threshold
+	passed = indices[threshold(values, thresh)]
+
+	# Crosses are passing samples whose previous sample did not pass
+	first = np.ones(passed.size, dtype=bool)
+	first[1:] = np.diff(passed) != 1
+	crossed_ind = passed[first]
+
+	rate = 0
+	if crossed_ind.size != 0:
+		crossed_ind = dead_time_filter(crossed_ind, dead_samples)
+
+		rate = len(crossed_ind) / (length / float(freq))
 
 	return rate
 
@@ -1,13 +1,126 @@
 import scipy.io
-# import h5py
+import numpy as np
+from core.data.segmented import SegmentedArray
 
-def load_matfile(filepath):
+def load_matfile(filepath, variable_names=None):
     '''
-    Load matfile
+    Load matfile, optionally only the given variables
     '''
     try:
-        return scipy.io.loadmat(filepath, mat_dtype=True)
+        return scipy.io.loadmat(filepath, mat_dtype=True, variable_names=variable_names)
     except NotImplementedError:
-        # Matfile version 7.3 loading, needs further testing
-        # return h5py.File(filepath)
-        return None
\ No newline at end of file
+        # Matfile version 7.3 is HDF5, variables are read lazily
+        from core.data.mat73 import MatFile73
+        return MatFile73(filepath)
+
+def list_matfile(filepath):
+    '''
+    List variable names in matfile without decoding any data
+    '''
+    try:
+        return [name for name, shape, mclass in scipy.io.whosmat(filepath)]
+    except NotImplementedError:
+        data = load_matfile(filepath)
+        try:
+            return data.keys()
+        finally:
+            data.close()
+
+def load_channel(filepath, channel):
+    '''
+    Load a single variable from matfile
+    '''
+    data = load_matfile(filepath, [channel])
+    return data.get(channel)
+
+# Dtypes of MATLAB classes, as loaded by loadmat with mat_dtype
+MATLAB_DTYPES = {'double': 'float64', 'single': 'float32', 'logical': 'bool',
+    'int8': 'int8', 'uint8': 'uint8', 'int16': 'int16', 'uint16': 'uint16',
+    'int32': 'int32', 'uint32': 'uint32', 'int64': 'int64', 'uint64': 'uint64'}
+
+def channel_shapes(filepath, channels):
+    '''
+    Number of samples and dtype of each channel in matfile without decoding any data
+    '''
+    try:
+        info = dict((name, (shape, MATLAB_DTYPES.get(mclass, 'float64')))
+                    for name, shape, mclass in scipy.io.whosmat(filepath))
+    except NotImplementedError:
+        data = load_matfile(filepath)
+        try:
+            info = dict((name, (data[name].shape, data[name].dtype)) for name in channels if name in data)
+        finally:
+            data.close()
+    return dict((channel, (int(np.prod(info[channel][0])), np.dtype(info[channel][1])))
+                for channel in channels if channel in info)
+
+def read_file_channels(filepath, channels, store=None, patient=None):
+    '''
+    Load channels of a single file, reading the file once
+    Converted copies in store are preferred over the matfile
+    '''
+    result = {}
+    missing = []
+    for channel in channels:
+        data = None
+        if store is not None:
+            data = store.load_channel(patient, filepath, channel)
+        if data is None:
+            missing.append(channel)
+        else:
+            result[channel] = data
+
+    if missing:
+        data = load_matfile(filepath, missing)
+        for channel in missing:
+            result[channel] = data.get(channel)
+    return result
+
+def read_segments(files, channels, store=None, patient=None):
+    '''
+    Channels of a depth split over several files as lazy concatenated arrays
+    '''
+    segments = dict((channel, ([], [], [])) for channel in channels)
+    for filepath in files:
+        # Converted copies already are lazy, matfile segments load on first access
+        mapped = {}
+        if store is not None:
+            for channel in channels:
+                data = store.load_channel(patient, filepath, channel)
+                if data is not None:
+                    mapped[channel] = data
+
+        shapes = {}
+        if len(mapped) < len(channels):
+            shapes = channel_shapes(filepath, [c for c in channels if c not in mapped])
+
+        for channel in channels:
+            loaders, sizes, dtypes = segments[channel]
+            if channel in mapped:
+                loaders.append(lambda data=mapped[channel]: data)
+                sizes.append(mapped[channel].size)
+                dtypes.append(mapped[channel].dtype)
+            elif channel in shapes:
+                loaders.append(lambda filepath=filepath, channel=channel: load_channel(filepath, channel))
+                sizes.append(shapes[channel][0])
+                dtypes.append(shapes[channel][1])
+
+    result = {}
+    for channel, (loaders, sizes, dtypes) in segments.items():
+        result[channel] = SegmentedArray(loaders, sizes, dtypes) if loaders else None
+    return result
+
+def read_channels(files, channels, store=None, patient=None):
+    '''
+    Load channels of a depth recorded in one or more files
+    Segments of a depth are presented as one array, files are in recording order
+    '''
+    if len(files) == 1:
+        return read_file_channels(files[0], channels, store, patient)
+    return read_segments(files, channels, store, patient)
+
+def read_channel(files, channel, store=None, patient=None):
+    '''
+    Load a channel of a depth recorded in one or more files
+    '''
+    return read_channels(files, [channel], store, patient)[channel]
@@ -0,0 +1,163 @@
+'''
+Lazy reader for MATLAB v7.3 (HDF5) matfiles
+'''
+
+import threading
+import h5py
+import numpy as np
+
+
+class MatFile73(object):
+    '''
+    Dict-like access to the variables of a v7.3 matfile
+    Variables are returned as lazy datasets, nothing is read until sliced
+    The file is reopened on demand after close, so datasets stay usable
+    '''
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.lock = threading.Lock()
+        self.file = None
+        self.open()
+
+    def open(self):
+        # Closed h5py files evaluate as False
+        if not self.file:
+            self.file = h5py.File(self.filepath, 'r')
+        return self.file
+
+    def keys(self):
+        with self.lock:
+            data = self.open()
+
+            # Skip MATLAB internal references and structs
+            return [key for key in data.keys()
+                    if not key.startswith('#') and isinstance(data[key], h5py.Dataset)]
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    # Single lookup instead of walking all variables like keys()
+    def dataset(self, key):
+        data = self.open()
+        if key.startswith('#') or key not in data:
+            return None
+        dataset = data[key]
+        return dataset if isinstance(dataset, h5py.Dataset) else None
+
+    def __contains__(self, key):
+        with self.lock:
+            return self.dataset(key) is not None
+
+    def __getitem__(self, key):
+        with self.lock:
+            dataset = self.dataset(key)
+            if dataset is None:
+                raise KeyError(key)
+            return LazyDataset(self, key, dataset.shape)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def read(self, key, ds_key):
+        with self.lock:
+            return self.open()[key][ds_key]
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+
+
+class LazyDataset(object):
+    '''
+    Array-like view of a MATLAB variable that reads only requested slices
+    MATLAB stores arrays column major, so axes are reversed to match loadmat
+    Slices are returned as float64, the same as loadmat with mat_dtype
+    '''
+
+    def __init__(self, owner, key, ds_shape, squeezed=False):
+        self.owner = owner
+        self.key = key
+        self.ds_shape = tuple(ds_shape)
+        self.squeezed = squeezed
+
+        # Dataset axis for each axis of this view
+        axes = range(len(self.ds_shape))[::-1]
+        if squeezed:
+            axes = [axis for axis in axes if self.ds_shape[axis] != 1]
+        self.axes = list(axes)
+
+    @property
+    def shape(self):
+        return tuple(self.ds_shape[axis] for axis in self.axes)
+
+    @property
+    def ndim(self):
+        return len(self.axes)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def dtype(self):
+        return np.dtype(np.float64)
+
+    @property
+    def nbytes(self):
+        # Memory taken once read in full
+        return self.size * self.dtype.itemsize
+
+    def __len__(self):
+        return self.shape[0]
+
+    def squeeze(self):
+        return LazyDataset(self.owner, self.key, self.ds_shape, squeezed=True)
+
+    # Release the file handle, it is reopened if read again
+    def close(self):
+        self.owner.close()
+
+    def __array__(self, dtype=None, copy=None):
+        data = self[...]
+        if dtype is not None:
+            data = data.astype(dtype)
+        return data
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+
+        # Expand ellipsis to full slices, compared by identity as arrays can't be compared
+        positions = [idx for idx, item in enumerate(key) if item is Ellipsis]
+        if positions:
+            idx = positions[0]
+            fill = (slice(None),) * (self.ndim - len(key) + 1)
+            key = key[:idx] + fill + key[idx + 1:]
+
+        # HDF5 only supports simple forward slicing, read everything otherwise
+        for item in key:
+            simple_int = isinstance(item, (int, np.integer))
+            simple_slice = isinstance(item, slice) and (item.step is None or item.step > 0)
+            if not (simple_int or simple_slice):
+                return np.asarray(self)[key]
+
+        if len(key) > self.ndim:
+            raise IndexError('too many indices for array')
+
+        # Squeezed singleton axes are indexed away
+        ds_key = [0] * len(self.ds_shape)
+        for axis in self.axes:
+            ds_key[axis] = slice(None)
+        for axis, item in zip(self.axes, key):
+            if isinstance(item, (int, np.integer)) and item < 0:
+                item += self.ds_shape[axis]
+            ds_key[axis] = item
+
+        # Remaining axes come back in dataset order
+        data = self.owner.read(self.key, tuple(ds_key))
+        return np.transpose(np.asarray(data, dtype=np.float64))
@@ -0,0 +1,124 @@
+'''
+Per channel .npy copies of recordings, opened memory mapped
+'''
+
+import os
+import json
+import numpy as np
+from core.data import loading
+
+
+MANIFEST_NAME = 'manifest.json'
+
+
+class NpyStore(object):
+    '''
+    Converted recordings stored as <path>/<patient>/<file>/<channel>.npy
+    A manifest per patient records the source file stats of each conversion
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.manifests = {}
+
+    def file_folder(self, patient, filepath):
+        name = os.path.splitext(os.path.basename(filepath))[0]
+        return os.path.join(self.path, patient, name)
+
+    def channel_path(self, patient, filepath, channel):
+        return os.path.join(self.file_folder(patient, filepath), channel + '.npy')
+
+    '''
+    Manifest methods
+    '''
+
+    def manifest(self, patient):
+        if patient not in self.manifests:
+            path = os.path.join(self.path, patient, MANIFEST_NAME)
+            if os.path.isfile(path):
+                with open(path, 'r') as f:
+                    self.manifests[patient] = json.load(f)
+            else:
+                self.manifests[patient] = {}
+        return self.manifests[patient]
+
+    def save_manifest(self, patient):
+        folder = os.path.join(self.path, patient)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        with open(os.path.join(folder, MANIFEST_NAME), 'w') as f:
+            json.dump(self.manifests[patient], f)
+
+    # Source file size and modification time
+    def file_stats(self, filepath):
+        stat = os.stat(filepath)
+        return [stat.st_size, stat.st_mtime]
+
+    # Check if the converted copy of a file is up to date
+    def is_current(self, patient, filepath):
+        entry = self.manifest(patient).get(os.path.basename(filepath))
+        if entry is None:
+            return False
+        return entry['stats'] == self.file_stats(filepath)
+
+    '''
+    Conversion
+    '''
+
+    def convert_file(self, patient, filepath):
+        data = loading.load_matfile(filepath)
+
+        folder = self.file_folder(patient, filepath)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        # Only plain numeric arrays can be memory mapped
+        channels = []
+        try:
+            for channel in data.keys():
+                if channel.startswith('__'):
+                    continue
+
+                # Lazy v7.3 variables are read one at a time here
+                value = np.asarray(data[channel])
+                if value.dtype.hasobject:
+                    continue
+                np.save(self.channel_path(patient, filepath, channel), value)
+                channels.append(channel)
+        finally:
+            # v7.3 files hold an HDF5 handle, loadmat dicts have nothing to close
+            if hasattr(data, 'close'):
+                data.close()
+
+        self.manifest(patient)[os.path.basename(filepath)] = {
+            'stats': self.file_stats(filepath),
+            'channels': sorted(channels)}
+
+    # Convert all files of a patient whose source has changed
+    def convert_patient(self, patient):
+        converted = 0
+        for files in patient.files:
+            for filepath in files:
+                if not self.is_current(patient.name, filepath):
+                    self.convert_file(patient.name, filepath)
+                    converted += 1
+
+        if converted:
+            self.save_manifest(patient.name)
+        return converted
+
+    '''
+    Loading
+    '''
+
+    def load_channel(self, patient, filepath, channel):
+        '''
+        Memory map a converted channel, None if not available
+        '''
+        entry = self.manifest(patient).get(os.path.basename(filepath))
+        if entry is None or channel not in entry['channels']:
+            return None
+        if entry['stats'] != self.file_stats(filepath):
+            return None
+        return np.load(self.channel_path(patient, filepath, channel), mmap_mode='r')
@@ -0,0 +1,97 @@
+'''
+Multi-resolution min/max summary of a trace for display
+Zoomed out views keep every peak, and a window costs the same at any recording length
+'''
+
+import numpy as np
+from core.data import settings
+
+# Samples read at a time for the first level, lazy data is never read in full
+PYRAMID_CHUNK = 2 ** 20
+
+
+def block_extrema(mins, maxs, factor):
+    '''
+    Min and max over consecutive blocks of factor values, the last block may be shorter
+    '''
+    full = mins.size // factor * factor
+
+    # Strided elementwise passes are much faster than reducing short rows
+    low = mins[0:full:factor].copy()
+    high = maxs[0:full:factor].copy()
+    for offset in range(1, factor):
+        np.minimum(low, mins[offset:full:factor], out=low)
+        np.maximum(high, maxs[offset:full:factor], out=high)
+    if full < mins.size:
+        low = np.append(low, mins[full:].min())
+        high = np.append(high, maxs[full:].max())
+    return low, high
+
+
+class MinMaxPyramid(object):
+    '''
+    Level k holds the min and max of blocks of factor ** (k + 1) samples
+    The samples themselves are not kept, window takes them as an argument
+    Data may be any array-like with slicing, only the window is read from it
+    '''
+
+    def __init__(self, data, factor=settings.pyramid_factor, chunk=PYRAMID_CHUNK):
+        self.factor = factor
+        self.length = data.size
+        self.levels = []
+        if self.length <= factor:
+            return
+
+        # First level from whole blocks of each chunk, slices of lazy and segmented data
+        chunk = max(chunk // factor, 1) * factor
+        mins, maxs = [], []
+        for start in range(0, self.length, chunk):
+            block = np.asarray(data[start:start + chunk])
+            low, high = block_extrema(block, block, factor)
+            mins.append(low.astype(np.float32))
+            maxs.append(high.astype(np.float32))
+
+        # Stored as float32, only used for drawing
+        mins, maxs = np.concatenate(mins), np.concatenate(maxs)
+        self.levels.append((mins, maxs))
+        while mins.size > factor:
+            mins, maxs = block_extrema(mins, maxs, factor)
+            mins = mins.astype(np.float32)
+            maxs = maxs.astype(np.float32)
+            self.levels.append((mins, maxs))
+
+    @property
+    def nbytes(self):
+        return sum(mins.nbytes + maxs.nbytes for mins, maxs in self.levels)
+
+    def window(self, data, start, stop, points):
+        '''
+        Sample positions and values covering [start, stop) with about points blocks
+        Raw samples are returned once they fit, otherwise interleaved block min and max
+        '''
+        start = max(int(np.floor(start)), 0)
+        stop = min(int(np.ceil(stop)) + 1, self.length)
+        points = max(int(points), 1)
+        count = stop - start
+        if count <= 0:
+            return np.zeros(0), np.zeros(0)
+
+        if count <= 2 * points or not self.levels:
+            return np.arange(start, stop), data[start:stop]
+
+        # Coarsest blocks still giving at least points blocks
+        level = 0
+        size = self.factor
+        while level + 1 < len(self.levels) and count // (size * self.factor) >= points:
+            level += 1
+            size *= self.factor
+
+        mins, maxs = self.levels[level]
+        first = start // size
+        last = min(-(-stop // size), mins.size)
+
+        x = np.repeat(np.arange(first, last) * size, 2)
+        y = np.empty(x.size, dtype=mins.dtype)
+        y[0::2] = mins[first:last]
+        y[1::2] = maxs[first:last]
+        return x, y
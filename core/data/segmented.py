@@ -0,0 +1,108 @@
+'''
+Lazy concatenation of a channel recorded over several files
+'''
+
+import numpy as np
+
+
+class SegmentedArray(object):
+    '''
+    One dimensional view of all segments of a channel, in recording order
+    Segments are loaded when first needed, slices only read the segments they cover
+    '''
+
+    def __init__(self, loaders, lengths, dtypes=None):
+        self.loaders = list(loaders)
+        self.lengths = [int(length) for length in lengths]
+        self.offsets = np.concatenate([[0], np.cumsum(self.lengths)]).astype(np.int64)
+        self.segments = [None] * len(self.loaders)
+
+        # Dtype of each segment once loaded, known without loading it
+        if dtypes is None:
+            dtypes = [np.float64] * len(self.loaders)
+        self.dtypes = [np.dtype(dtype) for dtype in dtypes]
+
+    def segment(self, idx):
+        if self.segments[idx] is None:
+            data = self.loaders[idx]()
+            self.segments[idx] = np.asarray(data).ravel()
+
+            # Lazy v7.3 segments are read in full, their file is not needed anymore
+            if not isinstance(data, np.ndarray) and hasattr(data, 'close'):
+                data.close()
+        return self.segments[idx]
+
+    @property
+    def shape(self):
+        return (int(self.offsets[-1]),)
+
+    @property
+    def ndim(self):
+        return 1
+
+    @property
+    def size(self):
+        return self.shape[0]
+
+    @property
+    def dtype(self):
+        if not self.loaders:
+            return np.dtype(float)
+        return np.result_type(*self.dtypes)
+
+    @property
+    def nbytes(self):
+        # Memory held once every segment is loaded, memory mapped segments included
+        return sum(length * dtype.itemsize for length, dtype in zip(self.lengths, self.dtypes))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def squeeze(self):
+        return self
+
+    # Drop loaded segments and their memory maps, they are loaded again when needed
+    def close(self):
+        self.segments = [None] * len(self.loaders)
+
+    def __array__(self, dtype=None, copy=None):
+        if not self.loaders:
+            data = np.array([])
+        else:
+            data = np.concatenate([self.segment(idx) for idx in range(len(self.loaders))])
+        if dtype is not None:
+            data = data.astype(dtype)
+        return data
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            if key < 0:
+                key += len(self)
+            if not 0 <= key < len(self):
+                raise IndexError('index out of bounds')
+            idx = np.searchsorted(self.offsets, key, side='right') - 1
+            return self.segment(idx)[key - self.offsets[idx]]
+
+        # Forward slices only touch the covered segments
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step > 0:
+                parts = []
+                for idx in range(len(self.loaders)):
+                    low, high = self.offsets[idx], self.offsets[idx + 1]
+                    first = max(start, low)
+
+                    # Keep the step aligned across segment boundaries
+                    first += (start - first) % step
+                    last = min(stop, high)
+                    if first < last:
+                        parts.append(self.segment(idx)[first - low:last - low:step])
+
+                # A slice within one segment stays a view
+                if len(parts) == 1:
+                    return parts[0]
+                if not parts:
+                    return np.array([], dtype=self.dtype)
+                return np.concatenate(parts)
+
+        return np.asarray(self)[key]
@@ -9,6 +9,9 @@ source_path = 'C:\MGH\data\\'
 # List of supported input files
 INPUT_FILETYPES = ['.mat']
 
+# Filename parser for depths and file numbers, see core/data/depths.py
+filename_parser = 'default'
+
 # Channel management defaults on new view
 only_data_channels = False
 only_spike_channels = True
@@ -31,6 +34,26 @@ reg_data = ['^(CRAW_0)([1-3])$', '^(CSPK_0)([1-3])$', '^(CLFP_0)([1-3])$',
 	'^(CRAW_1___0)([1-3])$', '^(CSPK_1___0)([1-3])$', '^(CLFP_1___0)([1-3])$']
 
 
+'''
+Cache settings
+'''
+
+# Memory budget for loaded recordings (in MB)
+cache_size = 2048
+
+# Background threads for loading data
+worker_threads = 2
+
+# Warm the cache for depths around the selection
+prefetch = True
+
+# Number of depths above and below the selection
+prefetch_neighbours = 2
+
+# Additional depths in recording direction (decreasing depth)
+prefetch_ahead = 2
+
+
 '''
 Annotation settings
 '''
@@ -62,6 +85,9 @@ GUI Settings
 # Individual plot heights
 plot_height = 200
 
+# Samples per block between levels of the min/max display pyramid
+pyramid_factor = 8
+
 # Units of X axis
 data_x_label = 'Time'
 data_x_units = 's'
@@ -100,6 +126,11 @@ spike_width = 0.001
 spike_threshold = 3 
 # Show Audio progress line
 show_audio_line = True
+# Audio output: 'device', 'null' (no output) or 'wave' (written to audio_wave_path)
+audio_sink = 'device'
+audio_wave_path = 'audio.wav'
+# Frames processed per audio callback
+audio_blocksize = 1024
 
 
 '''
@@ -109,11 +140,37 @@ Preprocessing settings
 # Preprocessing folder
 preprocessing_path = 'preprocessed'
 
+## Converted recordings
+
+# Convert each channel to a memory mapped .npy file on startup
+convert_recordings = False
+
+# Save settings
+converted_folder = 'npy'
+
 ## Hash rate storage
 
 # This is a flag that determines general display and use of hashes as well
 preprocess_hashes = True
 
+# Worker processes for hashrate preprocessing (None uses all cores, 1 runs serially)
+hashrate_processes = None
+
+# Memory budget for data held by all worker processes (in MB)
+hashrate_memory = 4096
+
+# Estimate noise floors from a random subsample of long recordings
+approximate_noise_floor = False
+
+# Register recordings added to loaded patients while running
+watch_folders = True
+
+# Seconds between polls of the patient folders
+watch_interval = 2
+
 # Save settings
 hashrates_folder = 'hashrates'
-hashrates_filename = 'hashrate_%s.csv'
+hashrates_filename = 'hashrate_%s.npz'
+
+# Hashrates saved by earlier versions, converted when first loaded
+legacy_hashrates_filename = 'hashrate_%s.csv'
@@ -1,8 +1,17 @@
-import glob
 import os
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+import threading
 from core.data import settings
 from core.data import depths
 from core.data import loading
+from core.data import features
+from core.annotations import AnnotationIndex, depth_span
 import numpy as np
 import colorsys
 
@@ -27,6 +36,7 @@ class Patient(object):
         # Hash rates
         self.hashrates = None
         self.hash_depth_list = None
+        self.features = None
         self.load_hashrates()
 
         # Load colormap
@@ -37,63 +47,115 @@ class Patient(object):
         Load all files with accepted filetype and grab depths
         '''
 
-        self.files = []
-        self.depths = []
-
-        # Get filenames, filepaths and depths
-        for i in settings.INPUT_FILETYPES:
-            files = glob.glob(os.path.join(self.path, ('*' + i)))
-            for j in files:
-                fn = os.path.split(j)[-1]
-                depth, file_nr = depths.default_parse(fn)
-                # Check that file is supported, if not throw it out
-                if depth is not None:
-                    if depth not in self.depths:
-                        # Append parsed depth
-                        self.depths.append(depth)
-                        self.files.append([j])
-                    else:
-                        idx = self.depths.index(depth)
-                        self.files[idx].append(j)
-
-        # Sort each attribute according to depth if not empty
-        if self.depths:
-            self.depths = map(float, self.depths)
-            zipped = zip(self.depths, self.files)
-            depth_sorted = zip(*sorted(zipped, reverse=True))
-            [self.depths, self.files] = map(list, depth_sorted)
-
-    def load(self, depth):
+        self.recordings = ([], [])
+        self.depth_files = {}
+
+        # Get filepaths in a single pass over the folder, extensions in any case like the old glob
+        filetypes = set(filetype.lower() for filetype in settings.INPUT_FILETYPES)
+        if scandir is not None:
+            paths = [entry.path for entry in scandir(self.path)
+                     if os.path.splitext(entry.name)[1].lower() in filetypes and entry.is_file()]
+        else:
+            paths = [os.path.join(self.path, fn) for fn in os.listdir(self.path)
+                     if os.path.splitext(fn)[1].lower() in filetypes]
+        self.add_files(paths)
+
+    # Depths and files are published together as one tuple, see add_files
+    @property
+    def depths(self):
+        return self.recordings[0]
+
+    @property
+    def files(self):
+        return self.recordings[1]
+
+    def files_of(self, depth):
         '''
-        Load a specific depth into memory
+        Files of a depth, None if the depth is unknown
         '''
+        return self.depth_files.get(depth)
 
-        if depth not in self.depths:
-            return None
+    def add_files(self, paths):
+        '''
+        Register recording files, keeping depths sorted in descending order
+        Returns the depths that were added or extended
+        '''
+
+        parse = depths.get_parser()
+        depth_list, files = self.recordings
+        groups = dict(zip(depth_list, [list(f) for f in files]))
+        numbers = {}
+        updated = []
+        changed = set()
+
+        for j in paths:
+            fn = os.path.split(j)[-1]
+            depth, file_nr = parse(fn)
+            # Check that file is supported, if not throw it out
+            if depth is None:
+                continue
+
+            depth = float(depth)
+            numbers[j] = int(file_nr)
+            groups.setdefault(depth, []).append(j)
+            if depth not in changed:
+                changed.add(depth)
+                updated.append(depth)
+
+        # Segments of a depth are kept in file number order
+        for depth in updated:
+            if len(groups[depth]) > 1:
+                groups[depth].sort(key=lambda f: numbers[f] if f in numbers else int(parse(os.path.split(f)[-1])[1]))
+
+        # One attribute swap, so threads reading recordings never pair a depth with other files
+        # The lookup by depth is a separate dict, which is consistent on its own
+        depth_list = sorted(groups, reverse=True)
+        self.depth_files = groups
+        self.recordings = (depth_list, [groups[depth] for depth in depth_list])
+
+        # Marker positions shift with new depths, rebuilt on next use
+        self.annotation_index = {}
+        return updated
+
+    def load(self, depth, channel):
+        '''
+        Load a single channel of a specific depth into memory
+        Returns the data ID and the data, which may be evicted from the cache at any time
+        '''
 
-        # Standard depth file data ID
-        data_id = ('std', self.name, depth)
+        current = self.files_of(depth)
+        if current is None:
+            return None, None
 
-        if data_id not in self.source.cache:
-            idx = self.depths.index(depth)
-            current = self.files[idx]
-            ext = current[0].split('.')[-1]
+        # Standard channel data ID
+        data_id = ('std', self.name, depth, channel)
 
-            if ext == 'mat':
-                if len(current) == 1:
-                    data = loading.load_matfile(current[0])
-                else:
-                    data = self.load_multiple(current)
+        data = self.source.cache.get(data_id)
+        if data is None:
+            ext = current[0].split('.')[-1].lower()
 
+            if ext == 'mat':
+                data = loading.read_channel(current, channel, self.source.store, self.name)
             else:
-                return None
+                return None, None
             self.source.load(data_id, data)
 
-        return data_id
+        return data_id, data
 
-    def load_multiple(self, data):
-        data = sorted(data)
-        return loading.load_matfile(data[0])
+    def list_channels(self, depth):
+        '''
+        List channel names of a specific depth without loading any data
+        '''
+
+        current = self.files_of(depth)
+        if current is None:
+            return []
+
+        ext = current[0].split('.')[-1].lower()
+
+        if ext == 'mat':
+            return loading.list_matfile(current[0])
+        return []
 
 
     '''
@@ -123,64 +185,40 @@ class Patient(object):
             color = np.array(colorsys.hsv_to_rgb(hue, .7, 1)) * 255
             self.colormap[label] = np.rint(color).astype(int)
 
-    # Compute annotation status bar
-    def get_annotation_markers(self, channel):
-        # Loop through all depths
-        bar = []
-        dots = []
-        current_label = None
-        start = None
-        prev = None
-
+    # Annotation markers of a channel, optionally only those touching depth_range (top, bottom)
+    def get_annotation_markers(self, channel, depth_range=None):
         # Convert channel to channel_nr
         channel_nr = self.source.get_channel_number(channel)
+        index = self.get_annotation_index(channel_nr)
+
+        low, high = 0, len(self.depths) - 1
+        if depth_range is not None:
+            low, high = depth_span(self.depths, max(depth_range), min(depth_range))
 
-        for depth in self.depths:
-            label_id = (depth, channel_nr)
-            if label_id in self.depth_labels:
-                labels = set(self.depth_labels[label_id])
-                
-                # Find the union of the labels
-                area = set(settings.continuous_labels).intersection(labels)
-                dot = set(settings.dot_labels).intersection(labels)
-
-                # Append all the dot notifications
-                if len(dot) > 0:
-                    dots.append((depth, list(dot)))
-
-                # Calculate the bar component
-                if len(area) == 1:
-                    # Start not being None means we're in a bar
-                    if start is not None:
-
-                        # Extend if we're in the same label
-                        if area.pop() == current_label:
-                            prev = depth
-                            # Skip over while necessary
-                            continue
-
-                    # Otherwise create a new bar
-                    else:
-                        start = depth
-                        prev = depth
-                        current_label = area.pop()
-                        # Skip over while necessary
-                        continue
-
-            # If we haven't continued, that means we need to break
-            if start is not None:
-                # Format is ((start, end), label)
-                bar.append(((start, prev), current_label, self.colormap[current_label]))
-                start = None
-                current_label = None
-                prev = None
-
-        # Wrap up last iteration
-        if start is not None:
-            bar.append(((start, depth), current_label, self.colormap[current_label]))
+        runs, dot_positions = index.markers(low, high)
 
+        # Format is ((start, end), label, color)
+        bar = [((self.depths[start], self.depths[end]), label, self.colormap[label])
+               for start, end, label in runs]
+        dots = [(self.depths[idx], labels) for idx, labels in dot_positions]
         return (bar, dots)
 
+    # Build the marker index of a channel on first use
+    def get_annotation_index(self, channel_nr):
+        index = self.annotation_index.get(channel_nr)
+        if index is None:
+            items = [(depth, labels) for (depth, nr), labels in self.depth_labels.items() if nr == channel_nr]
+            index = AnnotationIndex(self.depths, items)
+            self.annotation_index[channel_nr] = index
+        return index
+
+    # Replace the labels of a (depth, channel_nr) pair, keeping the marker index current
+    def set_depth_labels(self, label_id, labels):
+        self.depth_labels[label_id] = labels
+        index = self.annotation_index.get(label_id[1])
+        if index is not None:
+            index.set(label_id[0], labels)
+
     '''
     Preprocessing methods
     '''
@@ -188,21 +226,79 @@ class Patient(object):
     def load_hashrates(self):
         # Load filenames
         filename = settings.hashrates_filename % self.name
-        filepath = os.path.join(self.source.path, settings.preprocessing_path, settings.hashrates_folder, filename)
+        filepath = os.path.join(self.source.hash_cache.folder, filename)
+        if not os.path.isfile(filepath):
+            self.migrate_hashrates(filepath)
         if os.path.isfile(filepath):
-            self.hashrates = {}
-            self.hash_depth_list = {}
-            with open(filepath, 'rb') as csvfile:
-                for line in csvfile:
-                    current = line.splitlines()[0].split(',')
-                    self.hashrates[current[0]] = {}
-                    self.hash_depth_list[current[0]] = []
-                    for idx in range((len(current)-1)/2):
-                        self.hashrates[current[0]][float(current[idx*2+1])] = float(current[idx*2+2])
-                        self.hash_depth_list[current[0]].append(float(current[idx*2+2]))
-
-                    # Normalize depths
-                    d_list = np.array(self.hash_depth_list[current[0]])
-                    d_list = d_list / float(np.max(d_list))
-                    self.hash_depth_list[current[0]] = dict(zip(self.depths, d_list))
+            self.features = features.load_columns(filepath)
+            self.set_hashrates(self.features)
+
+    def migrate_hashrates(self, filepath):
+        '''
+        Convert hashrates saved as CSV by earlier versions
+        '''
+        filename = settings.legacy_hashrates_filename % self.name
+        folderpath = os.path.join(self.source.path, settings.preprocessing_path, settings.hashrates_folder)
+        for csvpath in [os.path.join(self.source.hash_cache.folder, filename), os.path.join(folderpath, filename)]:
+            if os.path.isfile(csvpath):
+                columns = features.hashrate_columns(features.read_hashrate_csv(csvpath))
+                features.save_columns(filepath, columns)
+                return
+
+    def set_hashrates(self, columns):
+        hashrates = {}
+        hash_depth_list = {}
+        for channel in np.unique(columns['channel']):
+            # Rows without a hashrate only hold other features
+            rows = (columns['channel'] == channel) & ~np.isnan(columns['hashrate'])
+            rates = columns['hashrate'][rows]
+            hashrates[channel] = dict(zip(columns['depth'][rows], rates))
+
+            # Normalize depths, channels without any crossings (or rates) stay at 0
+            peak = np.max(rates) if rates.size else 0
+            d_list = rates / float(peak) if peak > 0 else np.zeros_like(rates)
+            hash_depth_list[channel] = dict(zip(columns['depth'][rows], d_list))
+
+        # Hashrates last as they mark completion
+        self.hash_depth_list = hash_depth_list
+        self.hashrates = hashrates
+
+
+class PatientRegistry(object):
+    '''
+    Dict-like collection of patients by folder name
+    Each Patient is only created when first accessed
+    '''
+
+    def __init__(self, source, folders):
+        self.source = source
+        self.folders = list(folders)
+        self.loaded = {}
+        self.lock = threading.Lock()
+
+    def __contains__(self, name):
+        return name in self.folders
+
+    def __iter__(self):
+        return iter(self.folders)
+
+    def __len__(self):
+        return len(self.folders)
+
+    def keys(self):
+        return list(self.folders)
+
+    def is_loaded(self, name):
+        return name in self.loaded
+
+    def __getitem__(self, name):
+        patient = self.loaded.get(name)
+        if patient is None:
+            if name not in self.folders:
+                raise KeyError(name)
 
+            # Create outside the lock, the first finished object wins
+            patient = Patient(os.path.join(self.source.path, name, ''), self.source)
+            with self.lock:
+                patient = self.loaded.setdefault(name, patient)
+        return patient
@@ -0,0 +1,57 @@
+from core.data import settings
+
+
+# Queue priority of prefetch tasks, visible data should use lower values
+PREFETCH_PRIORITY = 100
+
+
+class Prefetcher(object):
+    '''
+    Warms the cache for depths around the current selection
+    Requests are grouped per view, a new selection cancels the previous one
+    '''
+
+    def __init__(self, source):
+        self.source = source
+
+    def update(self, view, patient, selected, channel):
+        pool = self.source.workers
+        pool.cancel((self, view))
+
+        if not settings.prefetch or not selected or channel is None:
+            return
+
+        for idx, depth in enumerate(self.candidates(patient, selected)):
+            pool.submit((self, view), PREFETCH_PRIORITY + idx, self.warm, patient, depth, channel)
+
+    def candidates(self, patient, selected):
+        '''
+        Depths to prefetch, nearest first
+        '''
+        indices = sorted(patient.depths.index(depth) for depth in selected if depth in patient.depths)
+        if not indices:
+            return []
+
+        n = settings.prefetch_neighbours
+
+        # Depths are sorted descending, so recording continues towards higher indices
+        above = range(indices[0] - 1, indices[0] - 1 - n, -1)
+        below = range(indices[-1] + 1, indices[-1] + 1 + n + settings.prefetch_ahead)
+
+        # Interleave both sides, extra depths ahead come last
+        order = []
+        for i in range(max(len(above), len(below))):
+            if i < len(below):
+                order.append(below[i])
+            if i < len(above):
+                order.append(above[i])
+
+        return [patient.depths[i] for i in order if 0 <= i < len(patient.depths)]
+
+    def warm(self, patient, depth, channel):
+        # Displayed data is pinned, so this only evicts stale entries
+        data_id, data = patient.load(depth, channel)
+
+        # Display pyramids are built here too
+        if data_id is not None:
+            self.source.get_pyramid(data_id, data)
@@ -1,10 +1,13 @@
-from patient import Patient
+from patient import Patient, PatientRegistry
+from workers import WorkerPool
+from prefetch import Prefetcher
+from watcher import Watcher
 from core.data import settings
 import core.data
 import os
 import re
+import threading
 import csv
-from tqdm import tqdm
 import numpy as np
 
 
@@ -16,14 +19,34 @@ class Source(object):
 
     def __init__(self, path=settings.source_path):
         # All the stuffs
-        self.cache = {}
+        self.cache = core.data.DataCache(settings.cache_size * 1024 ** 2)
+
+        # Hashrate process pool, created before any background threads start
+        if settings.preprocess_hashes:
+            self.hash_pool = core.data.hash_engine.make_pool()
+        else:
+            self.hash_pool = None
+
+        # Background loading
+        self.workers = WorkerPool(settings.worker_threads)
+        self.prefetcher = Prefetcher(self)
 
         # Settings
         self.init_settings()
 
         # Add separator if necessary
         self.path = os.path.join(path, '')
-        self.patients = {}
+
+        # Memory mapped copies of the recordings
+        if settings.convert_recordings:
+            self.store = core.data.NpyStore(
+                os.path.join(self.path, settings.preprocessing_path, settings.converted_folder))
+        else:
+            self.store = None
+
+        # Hashrate summaries keyed by file content and hash parameters
+        self.hash_cache = core.data.HashCache(
+            os.path.join(self.path, settings.preprocessing_path, settings.hashrates_folder))
 
         # Simple catch for bad paths
         if not os.path.isdir(self.path):
@@ -37,18 +60,16 @@ class Source(object):
             if settings.preprocessing_path in self.patient_folders:
                 self.patient_folders.remove(settings.preprocessing_path)
 
-            # Initialize all patient objects
-            for i in self.patient_folders:
-                patient = Patient(
-                    os.path.join(self.path, i, ''),
-                    self)
-                self.patients[i] = patient
-
-                # Preprocess if necessary   
-                if settings.preprocess_hashes and patient.hashrates is None:
-                    self.save_patient_hashrates(patient)
+        # Patient objects are only created when first accessed
+        self.patients = PatientRegistry(self, self.patient_folders)
 
+        # Background preprocessing thread
+        self.preprocess_thread = None
+        self.hash_lock = threading.Lock()
+        self.closed = False
 
+        # Recordings added during a live session
+        self.watcher = Watcher(self)
 
         # Annotation stuffs
         self.list_items = list(settings.depth_labels)
@@ -64,12 +85,88 @@ class Source(object):
         self.patient_labels = settings.patient_labels
         self.depth_labels = settings.depth_labels
 
+    def start_preprocessing(self):
+        '''
+        Convert recordings and compute missing hashrates in the background
+        '''
+        if self.preprocess_thread is not None:
+            return
+
+        self.preprocess_thread = threading.Thread(target=self.preprocess)
+        self.preprocess_thread.daemon = True
+        self.preprocess_thread.start()
+
+        if settings.watch_folders:
+            self.watcher.start()
+
+    def close(self):
+        '''
+        Stop all background work of this source, running tasks finish first
+        '''
+        self.closed = True
+        self.watcher.close()
+        self.workers.close()
+
+        # Release file handles and loaded data, lazy data reopens its file if still in use
+        self.cache.clear()
+
+        # Hashrates in progress still use the pool, it is closed once they are done
+        if self.hash_pool is not None:
+            thread = threading.Thread(target=self.close_pool)
+            thread.daemon = True
+            thread.start()
+
+    def close_pool(self):
+        with self.hash_lock:
+            self.hash_pool.close()
+            self.hash_pool.join()
+            self.hash_pool = None
+
+    def preprocess(self):
+        for name in self.patient_folders:
+            if self.closed:
+                return
+            patient = self.patients[name]
+
+            # Convert new or changed recordings
+            if self.store is not None:
+                self.store.convert_patient(patient)
+
+            # Preprocess if necessary
+            if settings.preprocess_hashes:
+                self.update_patient_hashrates(patient)
+
+    def update_patient_hashrates(self, patient):
+        '''
+        Recompute hashrates if files were added or changed, only new depths are read
+        '''
+        with self.hash_lock:
+            if self.closed or not patient.depths:
+                return
+            if patient.hashrates is not None and self.hash_cache.is_current(patient):
+                return
+            self.save_patient_hashrates(patient)
+        self.s.hashrates_updated.emit(patient.name)
+
     def load(self, data_id, data):
         '''
         Function to cache
         '''
         self.cache[data_id] = data
 
+    def get_pyramid(self, data_id, data):
+        '''
+        Min/max display pyramid of loaded data, built once and cached
+        '''
+        pyramid_id = ('pyramid',) + data_id
+
+        # Kept here, the entry may be evicted again by other workers
+        pyramid = self.cache.get(pyramid_id)
+        if pyramid is None:
+            pyramid = core.data.MinMaxPyramid(data.squeeze())
+            self.load(pyramid_id, pyramid)
+        return pyramid
+
     def write(self, storage, params):
         '''
         Function to write from shared memory to disk
@@ -92,18 +189,17 @@ class Source(object):
         # If default src_depth_idx=0, assume all channels can be found
         src_depth = cur_patient.depths[src_depth_idx]
         data_id = ('channels', patient, src_depth)
-        if data_id not in self.cache:
-            file_id = cur_patient.load(src_depth)
-
+        channels = self.cache.get(data_id)
+        if channels is None:
             # Load raw channel names
-            channels = self.cache[file_id].keys()
+            channels = cur_patient.list_channels(src_depth)
 
             # Parse channels
             channels = core.data.CleanChannels(channels)
 
             self.load(data_id, channels)
 
-        return self.cache[data_id]
+        return channels
 
     '''
     Custom methods to be separated into another file and
@@ -161,71 +257,33 @@ class Source(object):
             print('Patient not found!')
             return
 
-        hashes = {}
         print('Calculating hashrates for patient: %s' % patient.name)
 
+        # Files added by the watcher meanwhile are left for the next update
+        recordings = patient.recordings
+
         # Find the appropriate channels in this patient
         spike_channels = []
-        file = self.cache[patient.load(patient.depths[0])]
+        file = patient.list_channels(recordings[0][0])
         for channel in settings.spike_channels:
             if channel in file:
                 spike_channels.append(channel)
         spike_channels.sort()
 
-        # Compute noisefloor
-        noise_floor = {}
-        with tqdm(total=(len(spike_channels)*len(patient.depths))) as pbar:
-            for channel in spike_channels:
-                noise_floor[channel] = []
-                for depth in patient.depths:
-                    data = self.cache[patient.load(depth)][channel]    
-                    noise_floor[channel].append(core.data.noise_floor(data, settings.data_hz, depth))
-                    pbar.update()
-        for channel in noise_floor:
-            noise_floor[channel] = np.nanmedian(noise_floor[channel])
-
-        # Compute hashrates
-        for channel in spike_channels:
-            hashes[channel] = []
-            idx = 0
-            for depth in patient.depths:
-                data = self.cache[patient.load(depth)][channel]
-                hashes[channel].append(depth)
-                hashes[channel].append(core.data.hash_rate(data, settings.data_hz, depth, noise_floor[channel]))
-
-        # for depth in patient.depths:
-        #     data_id = patient.load(depth)
-        #     file = self.cache[data_id]
-        #     for channel in spike_channels:
-        #         data = file[channel]
-        #         if channel not in hashes:
-        #             hashes[channel] = []
-        #         hashes[channel].append(float(depth))
-        #         hashes[channel].append(core.data.hash_rate(data, settings.data_hz, noise_floor[channel]))
-
-        # Save to file
-        filename = settings.hashrates_filename % patient.name
-        folderpath = os.path.join(self.path, settings.preprocessing_path, settings.hashrates_folder)
-        if not os.path.exists(folderpath):
-            os.makedirs(folderpath)
+        # Spread noise floor and hashrate work over the process pool
+        store_path = self.store.path if self.store is not None else None
+        hashes = core.data.hash_engine.compute_hashrates(
+            patient, spike_channels, store_path, self.hash_cache, recordings, self.hash_pool)
 
-        path = os.path.join(folderpath, filename)
-        with open(path, 'wb') as out:
-            csv_writer = csv.writer(out, delimiter=',')
-            for key, value in hashes.items():
-                csv_writer.writerow([key] + value)
+        # Save to file, next to the summaries of the current parameters
+        columns = core.data.features.hashrate_columns(hashes)
+        if patient.features is not None:
+            columns = core.data.features.merge_columns(patient.features, columns)
+
+        filename = settings.hashrates_filename % patient.name
+        core.data.features.save_columns(os.path.join(self.hash_cache.folder, filename), columns)
+        self.hash_cache.save_manifest(patient, recordings[1])
 
         # Load into patient
-        patient.hashrates = {}
-        patient.hash_depth_list = {}
-        for channel, hashvalues in hashes.items():
-            patient.hashrates[channel] = {}
-            patient.hash_depth_list[channel] = []
-            for idx in range(len(hashvalues)/2):
-                patient.hashrates[channel][hashvalues[idx*2]] = hashvalues[idx*2+1]
-                patient.hash_depth_list[channel].append(hashvalues[idx*2+1])
-
-            # Normalize the depth list
-            d_list = np.array(patient.hash_depth_list[channel])
-            d_list = d_list / float(np.max(d_list))
-            patient.hash_depth_list[channel] = dict(zip(patient.depths, d_list))
+        patient.features = columns
+        patient.set_hashrates(columns)
@@ -0,0 +1,124 @@
+from pyqtgraph import QtCore
+from core.data import settings
+import os
+import threading
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+class Watcher(object):
+    '''
+    Polls the folders of loaded patients for recordings added during a session
+    Only folders whose mtime changed are listed, so a poll costs a few stat calls
+    New files are registered once their size stops changing
+    '''
+
+    def __init__(self, source, interval=settings.watch_interval):
+        self.source = source
+
+        # Folder mtimes and known files from the last poll
+        self.mtimes = {}
+        self.known = {}
+
+        # Files still being written, by folder: {path: size}
+        self.pending = {}
+
+        # Polling runs in the GUI thread, so patients are only changed there
+        self.timer = QtCore.QTimer()
+        self.timer.setInterval(int(interval * 1000))
+        self.timer.timeout.connect(self.poll)
+
+        # Hashrates of updated patients are computed in the background
+        self.queue = queue.Queue()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+        self.timer.start()
+
+    def stop(self):
+        self.timer.stop()
+
+    # Stop polling and end the hashrate thread once its current patient is done
+    def close(self):
+        self.stop()
+        self.queue.put(None)
+
+    def poll(self):
+        for name in list(self.source.patients.loaded):
+            patient = self.source.patients[name]
+            added = self.poll_patient(patient)
+
+            if added:
+                self.source.s.depths_added.emit(name)
+                if settings.preprocess_hashes:
+                    self.queue.put(name)
+
+    def poll_patient(self, patient):
+        '''
+        Register stable new files of a patient, returns the updated depths
+        '''
+        folder = patient.path
+        try:
+            mtime = os.stat(folder).st_mtime
+        except OSError:
+            return []
+
+        # First poll only records the current state
+        if folder not in self.known:
+            self.known[folder] = set(f for files in patient.files for f in files)
+            self.mtimes[folder] = mtime
+            return []
+
+        pending = self.pending.setdefault(folder, {})
+        if mtime != self.mtimes[folder]:
+            self.mtimes[folder] = mtime
+            filetypes = set(filetype.lower() for filetype in settings.INPUT_FILETYPES)
+            for filename in os.listdir(folder):
+                path = os.path.join(folder, filename)
+                if path in self.known[folder] or path in pending:
+                    continue
+                if os.path.splitext(filename)[1].lower() in filetypes:
+                    pending[path] = None
+
+        # Files are ready once their size is the same over two polls
+        ready = []
+        for path, size in list(pending.items()):
+            try:
+                current = os.path.getsize(path)
+            except OSError:
+                pending.pop(path)
+                continue
+
+            if current > 0 and current == size:
+                ready.append(path)
+                pending.pop(path)
+            else:
+                pending[path] = current
+
+        if not ready:
+            return []
+
+        self.known[folder].update(ready)
+        return patient.add_files(sorted(ready))
+
+    def run(self):
+        while True:
+            name = self.queue.get()
+
+            # Several polls may have queued the same patient
+            names = set([name])
+            while not self.queue.empty():
+                names.add(self.queue.get())
+
+            # Queued by close
+            if None in names:
+                return
+
+            for name in names:
+                self.source.update_patient_hashrates(self.source.patients[name])
@@ -0,0 +1,77 @@
+import threading
+import itertools
+import traceback
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+class WorkerPool(object):
+    '''
+    Daemon threads running tasks from a priority queue
+    Tasks are submitted in groups, cancelling a group drops its queued tasks
+    '''
+
+    def __init__(self, workers):
+        self.queue = queue.PriorityQueue()
+        self.lock = threading.Lock()
+        self.closed = False
+
+        # Current generation of each group, older tasks are stale
+        self.generations = {}
+
+        # Tie breaker to keep submission order within a priority
+        self.counter = itertools.count()
+
+        self.threads = []
+        for _ in range(workers):
+            thread = threading.Thread(target=self.run)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, group, priority, func, *args):
+        '''
+        Queue func(*args), lower priority values run first
+        '''
+        with self.lock:
+            if self.closed:
+                return
+            generation = self.generations.setdefault(group, 0)
+            self.queue.put((priority, next(self.counter), group, generation, func, args))
+
+    def cancel(self, group):
+        with self.lock:
+            self.generations[group] = self.generations.get(group, 0) + 1
+
+    def is_current(self, group, generation):
+        with self.lock:
+            return not self.closed and self.generations.get(group, 0) == generation
+
+    def close(self):
+        '''
+        Drop all queued tasks, threads stop once their current task is done
+        '''
+        with self.lock:
+            self.closed = True
+
+        # One stop task per thread, ahead of any queued task
+        for _ in self.threads:
+            self.queue.put((float('-inf'), next(self.counter), None, 0, None, ()))
+
+    def run(self):
+        while True:
+            priority, _, group, generation, func, args = self.queue.get()
+            if func is None:
+                self.queue.task_done()
+                return
+
+            # Skip tasks cancelled while queued
+            if self.is_current(group, generation):
+                try:
+                    func(*args)
+                except Exception:
+                    traceback.print_exc()
+
+            self.queue.task_done()
@@ -0,0 +1,15 @@
+import os
+import sys
+import types
+
+# The core package imports the GUI stack in its __init__, which these tests don't need
+# core and core.data are registered as plain packages so their modules import on their own
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+for name, path in [('core', ['core']), ('core.data', ['core', 'data'])]:
+    if name not in sys.modules:
+        package = types.ModuleType(name)
+        package.__path__ = [os.path.join(root, *path)]
+        sys.modules[name] = package
+
+# Modules in core/data import each other by name, so they are imported from there directly
+sys.path.insert(0, os.path.join(root, 'core', 'data'))
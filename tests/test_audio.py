@@ -0,0 +1,73 @@
+'''
+Streamed audio written by the null and wave sinks
+'''
+
+import wave
+import numpy as np
+import audio
+import create_neural_audio
+
+
+def recording(length, seed=0):
+    return np.random.RandomState(seed).randn(length, 1) * 20 + 5
+
+
+def drain(sink, stream):
+    sink.start(stream)
+    blocks = []
+    while sink.active():
+        blocks.append(sink.step())
+    return np.concatenate(blocks)
+
+
+def test_null_sink_same_rate():
+    data = recording(10007)
+    for spikes_only in [False, True]:
+        stream = audio.AudioStream(data, 44000, 44000, spikes_only=spikes_only)
+        sink = audio.NullSink(44000, blocksize=1000)
+        output = drain(sink, stream)
+
+        expected = create_neural_audio.preprocess_audio(data, spikes_only=spikes_only)
+        assert output.size == stream.frames == data.shape[0]
+        assert sink.position() == output.size
+        assert np.allclose(output, expected, atol=1e-6)
+
+
+def test_null_sink_resampled():
+    data = recording(10007, seed=1)
+    stream = audio.AudioStream(data, 24000, 44000)
+    output = drain(audio.NullSink(44000, blocksize=999), stream)
+
+    # Frames up to the last recording sample, linearly interpolated
+    frames = int((data.shape[0] - 1) * 44000 / 24000.) + 1
+    positions = np.arange(frames) * (24000 / 44000.)
+    expected = np.interp(positions, np.arange(data.shape[0]), create_neural_audio.preprocess_audio(data))
+    assert output.size == stream.frames == frames
+    assert np.allclose(output, expected, atol=1e-6)
+
+
+def read_wave(path):
+    source = wave.open(path, 'rb')
+    try:
+        assert source.getnchannels() == 1 and source.getsampwidth() == 2
+        return source.getframerate(), np.frombuffer(source.readframes(source.getnframes()), dtype='<i2')
+    finally:
+        source.close()
+
+
+def test_wave_sink(tmpdir):
+    data = recording(5003, seed=2)
+    expected = create_neural_audio.preprocess_audio(data)
+    for freq, rate in [(44000, 44000), (30000, 44000)]:
+        path = str(tmpdir.join('%d.wav' % freq))
+        stream = audio.AudioStream(data, freq, rate)
+        sink = audio.WaveSink(path, rate, blocksize=1000)
+        sink.start(stream)
+        sink.join()
+
+        framerate, frames = read_wave(path)
+        positions = np.arange(stream.frames) * (freq / float(rate))
+        resampled = np.interp(positions, np.arange(data.shape[0]), expected)
+        assert framerate == rate
+        assert frames.size == stream.frames
+        assert np.abs(frames - np.clip(resampled, -1, 1) * 32767).max() <= 1
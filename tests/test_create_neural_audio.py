@@ -0,0 +1,57 @@
+'''
+Equivalence of the linear time spike mask dilation with the original loop
+'''
+
+import numpy as np
+import create_neural_audio
+
+
+# Original loop from preprocess_audio, each shifted copy is ORed into the running result
+def dilate_loop(keep, spike_bin):
+    for idx in np.arange(-spike_bin, spike_bin + 1):
+        if idx < 0:
+            keep = np.logical_or(keep, np.pad(keep[-idx:], (0, -idx), 'constant', constant_values=(0)))
+        elif idx > 0:
+            keep = np.logical_or(keep, np.pad(keep[:-idx], (idx, 0), 'constant', constant_values=(0)))
+    return keep
+
+
+# Original preprocess_audio with the loop
+def preprocess_audio_loop(data, spike_threshold=create_neural_audio.SPIKE_THRESHOLD):
+    data = np.array(data).squeeze()
+    data = data - data.mean()
+    output = data / np.abs(data).max()
+
+    sd = data.std()
+    spike_bin = int(create_neural_audio.OUTPUT_SAMPLE_RATE * create_neural_audio.SPIKE_WIDTH / 2)
+    keep = np.logical_or(data > sd * spike_threshold, data < -sd * spike_threshold).squeeze()
+    output[~dilate_loop(keep, spike_bin)] = 0
+    return output
+
+
+def test_dilate_matches_loop():
+    rng = np.random.RandomState(0)
+    for _ in range(500):
+        # The loop needs at least spike_bin samples
+        spike_bin = rng.randint(0, 8)
+        size = rng.randint(max(spike_bin, 1), 300)
+        keep = rng.rand(size) < rng.choice([0, .01, .05, .3])
+
+        expected = dilate_loop(keep, spike_bin)
+        result = create_neural_audio.dilate(keep, spike_bin * (spike_bin + 1) // 2)
+        assert np.array_equal(expected, result)
+
+
+def test_dilate_edges():
+    keep = np.zeros(20, dtype=bool)
+    keep[[0, 19]] = True
+    assert np.array_equal(dilate_loop(keep, 3), create_neural_audio.dilate(keep, 6))
+    assert not create_neural_audio.dilate(np.zeros(5, dtype=bool), 3).any()
+
+
+def test_preprocess_audio_matches_loop():
+    data = np.random.RandomState(1).randn(create_neural_audio.OUTPUT_SAMPLE_RATE * 2, 1)
+    for spike_threshold in [2, 3, 4]:
+        expected = preprocess_audio_loop(data, spike_threshold)
+        result = create_neural_audio.preprocess_audio(data, spikes_only=True, spike_threshold=spike_threshold)
+        assert np.array_equal(expected, result)
@@ -0,0 +1,95 @@
+'''
+Equivalence of the vectorized dead time filter with the original loop
+'''
+
+import numpy as np
+import hash_function
+
+
+# Original loop from hash_rate, the eliminated sample indices are passed to np.delete as positions
+# numpy < 1.19 ignores positions past the end, newer versions raise, so they are dropped here
+def dead_time_filter_loop(crossed_ind, dead_samples):
+    elim = []
+
+    last_ind = crossed_ind[0]
+    for ind in crossed_ind[1:]:
+        if ind - last_ind < dead_samples:
+            elim.append(ind)
+        else:
+            last_ind = ind
+
+    elim = [ind for ind in elim if ind < crossed_ind.size]
+    return np.delete(crossed_ind, np.array(elim, dtype=int))
+
+
+def random_crossings(rng, size, span):
+    return np.unique(rng.randint(0, span, size))
+
+
+def test_matches_loop_on_random_crossings():
+    rng = np.random.RandomState(0)
+    for _ in range(2000):
+        # Small spans make eliminated indices fall inside the positions as well
+        crossed_ind = random_crossings(rng, rng.randint(1, 200), rng.choice([50, 500, 50000]))
+        dead_samples = rng.choice([0, 1, 2.5, 13.2, 40])
+
+        expected = dead_time_filter_loop(crossed_ind, dead_samples)
+        result = hash_function.dead_time_filter(crossed_ind, dead_samples)
+        assert np.array_equal(expected, result)
+
+
+def test_matches_loop_on_noise():
+    freq = 44000
+    data = np.random.RandomState(1).randn(freq * 10)
+    dead_samples = hash_function.DEAD_TIME_MS * freq / 1000
+
+    crossed = hash_function.threshold(data, 2)
+    crossed[1:][crossed[:-1] & crossed[1:]] = False
+    crossed_ind = np.where(crossed)[0]
+
+    expected = dead_time_filter_loop(crossed_ind, dead_samples)
+    result = hash_function.dead_time_filter(crossed_ind, dead_samples)
+    assert np.array_equal(expected, result)
+
+
+def test_hash_rate_counts_unchanged():
+    freq = 44000
+    data = np.random.RandomState(2).randn(freq * 2)
+    thresh = 2.
+
+    crossed = hash_function.threshold(data, thresh)
+    crossed[1:][crossed[:-1] & crossed[1:]] = False
+    crossed_ind = np.where(crossed)[0]
+    dead_samples = hash_function.DEAD_TIME_MS * freq / 1000
+    expected = len(dead_time_filter_loop(crossed_ind, dead_samples)) / (len(crossed) / float(freq))
+
+    assert hash_function.hash_rate(data, freq, 0, thresh) == expected
+
+
+# Greedy loop the mask follows, kept crossings start the dead interval
+def dead_time_mask_loop(crossed_ind, dead_samples):
+    keep = np.zeros(crossed_ind.size, dtype=bool)
+    last_ind = None
+    for idx, ind in enumerate(crossed_ind):
+        if last_ind is None or ind - last_ind >= dead_samples:
+            keep[idx] = True
+            last_ind = ind
+    return keep
+
+
+def test_mask_matches_greedy_loop():
+    rng = np.random.RandomState(3)
+    for _ in range(2000):
+        crossed_ind = random_crossings(rng, rng.randint(0, 300), rng.choice([50, 500, 50000]))
+        dead_samples = rng.choice([0, 1, 2.5, 13.2, 40])
+
+        expected = dead_time_mask_loop(crossed_ind, dead_samples)
+        assert np.array_equal(expected, hash_function.dead_time_mask(crossed_ind, dead_samples))
+
+
+def test_mask_on_long_bursts():
+    # Every sample crosses, so the kept crossings form one long chain
+    crossed_ind = np.arange(100000)
+    for dead_samples in [1, 3.5, 13.2, 99999, 100000]:
+        expected = dead_time_mask_loop(crossed_ind, dead_samples)
+        assert np.array_equal(expected, hash_function.dead_time_mask(crossed_ind, dead_samples))